@@ -0,0 +1,89 @@
+import sys
+import numpy as np
+
+from logArrays import concatRecords, readRecordChunks, recordEpoch, selectRecords
+
+# Converts G-directory logs to bGeigie $BNRDD lines for the Safecast tools:
+# $BNRDD,<id>,<date>,<CPM>,<counts 5 s>,<total counts>,<CPM valid>,
+#        <lat DDMM.MMMM>,<N/S>,<lon DDDMM.MMMM>,<E/W>,<alt>,<GPS valid>,<nSat>,<hdop>*<XOR checksum>
+# CPM is the 60 s rolling count rate from the spectrum counts and live time.
+
+CPM_WINDOW = 60
+COUNTS_WINDOW = 5
+
+
+def nmeaDegMin(v):
+    # Integer arithmetic on 1e-4 minutes so 59.99999 never prints as 60.0000
+    units = np.rint(np.abs(v) * 600000).astype(np.int64)
+    deg = units // 600000
+    minutes = units % 600000
+    return deg, minutes // 10000, minutes % 10000
+
+
+def windowSums(t, values, window):
+    # Sum of values over records in (t - window, t], t sorted
+    c = np.concatenate([[0], np.cumsum(values)])
+    j = np.searchsorted(t, t - window, 'right')
+    return c[1:] - c[j]
+
+
+def checksums(bodies):
+    # NMEA checksum of every body (text between $ and *) at once
+    lengths = np.fromiter((len(b) for b in bodies), np.int64, len(bodies))
+    buf = np.frombuffer(''.join(bodies).encode('ascii'), np.uint8)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.bitwise_xor.reduceat(buf, starts)
+
+
+def formatLines(recs, deviceId, cpm, counts5, total, cpmValid):
+    t = recordEpoch(recs)
+    dates = np.datetime_as_string(t.astype('datetime64[s]'))
+    latD, latM, latF = nmeaDegMin(recs['lat'])
+    lonD, lonM, lonF = nmeaDegMin(recs['lon'])
+    ns = np.where(recs['lat'] < 0, 'S', 'N')
+    ew = np.where(recs['lon'] < 0, 'W', 'E')
+    gpsValid = np.where(recs['fix'] == 1, 'A', 'V')
+    cpmA = np.where(cpmValid, 'A', 'V')
+    # HDOP in hundredths, as TinyGPS hdop() reports it on the bGeigie
+    hdop = np.rint(recs['hdop'] * 100).astype(np.int64)
+    tmpl = 'BNRDD,%s,%sZ,%d,%d,%d,%s,%02d%02d.%04d,%s,%03d%02d.%04d,%s,%.2f,%s,%d,%d'
+    bodies = [tmpl % row for row in zip(
+        [deviceId] * len(t), dates, np.rint(cpm).astype(np.int64).tolist(), counts5.tolist(), total.tolist(),
+        cpmA, latD.tolist(), latM.tolist(), latF.tolist(), ns, lonD.tolist(), lonM.tolist(), lonF.tolist(), ew,
+        recs['alt'].tolist(), gpsValid, recs['nSat'].tolist(), hdop.tolist())]
+    sums = checksums(bodies)
+    return ''.join('$%s*%02X\n' % bs for bs in zip(bodies, sums.tolist()))
+
+
+def exportBGeigie(dirs, out, deviceId='0000', rootDir='./'):
+    # Streams the logs to out (a text file object). The last CPM_WINDOW
+    # seconds of each chunk are carried into the next so windows span files.
+    carry = None
+    total = 0
+    nLines = 0
+    for chunk in readRecordChunks(dirs, rootDir):
+        n = len(chunk['time'])
+        if n == 0:
+            continue
+        recs = chunk if carry is None else concatRecords([carry, chunk])
+        t = recordEpoch(recs)
+        counts = recs['hist'].sum(axis=1)
+        live = np.maximum(recs['time'], 1)
+        cWin = windowSums(t, counts, CPM_WINDOW)
+        lWin = windowSums(t, live, CPM_WINDOW)
+        c5 = windowSums(t, counts, COUNTS_WINDOW)
+        new = slice(len(t) - n, len(t))
+        tot = total + np.cumsum(counts[new])
+        out.write(formatLines(chunk, deviceId, cWin[new] * 60.0 / lWin[new], c5[new], tot,
+                              lWin[new] >= CPM_WINDOW))
+        total = int(tot[-1])
+        nLines += n
+        carry = selectRecords(recs, np.nonzero(t > t[-1] - CPM_WINDOW)[0])
+    return nLines
+
+
+if __name__ == '__main__':
+    dirs = sys.argv[1:] if len(sys.argv) > 1 else ['G0000000']
+    with open('bGeigie.log', 'w', buffering=1 << 20) as out:
+        n = exportBGeigie(dirs, out)
+    print('lines written = ' + str(n))
@@ -0,0 +1,86 @@
+import sys
+import numpy as np
+
+from logArrays import defaultEcal, readRecords
+from energyRebin import channelEdgesKeV, overlapMatrix
+from spectrumFiles import readSpectrumFile
+import cellGrid as cg
+
+# Background subtraction over all cells. The background is a count rate
+# spectrum in device channels with its variance, taken from a reference
+# spectrum file or from the lowest-rate cells of the survey itself.
+
+# keV windows for the usual natural and man-made lines
+roisDefault = {
+    'Cs137': (600.0, 720.0),
+    'K40': (1370.0, 1570.0),
+    'U238': (1660.0, 1860.0),
+    'Th232': (2410.0, 2810.0),
+}
+
+
+def backgroundFromFile(path, ecal=defaultEcal, nChannels=None, index=0):
+    # Reference spectrum rebinned by energy onto the device channels
+    counts, live, edges = readSpectrumFile(path, index)
+    if nChannels is None:
+        nChannels = len(counts)
+    M = overlapMatrix(edges, channelEdgesKeV(ecal, nChannels))
+    c = M.T @ counts
+    return c / live, c / (live * live)
+
+
+def backgroundFromCells(cells, quantile=0.2, minTime=10):
+    # Sum of the cells in the lowest quantile of gross count rate, among
+    # those with at least minTime seconds
+    t = np.asarray(cells['time'], dtype=np.float64)
+    rate = cells['hist'].sum(axis=1) / t
+    ok = t >= minTime
+    if not ok.any():
+        ok = t > 0
+    low = ok & (rate <= np.quantile(rate[ok], quantile))
+    c = cells['hist'][low].sum(axis=0).astype(np.float64)
+    live = t[low].sum()
+    return c / live, c / (live * live)
+
+
+def roiMatrix(rois, ecal=defaultEcal, nChannels=cg.SPECTRUM_LEN):
+    # 0/1 (nChannels, nRoi) matrix, channel in window by its keV
+    keV = cg.channelKeV(ecal, nChannels)
+    lo = np.array([r[0] for r in rois.values()])
+    hi = np.array([r[1] for r in rois.values()])
+    return ((keV[:, None] >= lo) & (keV[:, None] < hi)).astype(np.float64)
+
+
+def subtractBackground(cells, bgRate, bgVar, rois=roisDefault, ecal=defaultEcal):
+    # Net spectra for every cell in one broadcast, plus net ROI rates with
+    # their uncertainties: Poisson on the cell counts and the background
+    # rate variance scaled by the cell live time
+    t = np.asarray(cells['time'], dtype=np.float64)
+    hist = cells['hist']
+    net = hist - bgRate[None, :] * t[:, None]
+    R = roiMatrix(rois, ecal, hist.shape[1])
+    gross = hist @ R
+    bgRoi = bgRate @ R
+    bgRoiVar = bgVar @ R
+    netRate = gross / t[:, None] - bgRoi[None, :]
+    netErr = np.sqrt(gross / (t * t)[:, None] + bgRoiVar[None, :])
+    out = {'net': net, 'roiNames': list(rois)}
+    for j, name in enumerate(rois):
+        out[name] = netRate[:, j]
+        out[name + 'Err'] = netErr[:, j]
+        out[name + 'Sig'] = np.where(netErr[:, j] > 0, netRate[:, j] / np.where(netErr[:, j] > 0, netErr[:, j], 1.0), 0.0)
+    return out
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    if len(sys.argv) > 1:
+        bgRate, bgVar = backgroundFromFile(sys.argv[1], nChannels=cells['hist'].shape[1])
+    else:
+        bgRate, bgVar = backgroundFromCells(cells)
+    res = subtractBackground(cells, bgRate, bgVar)
+    print('background = ' + str(bgRate.sum()) + ' cps')
+    for name in res['roiNames']:
+        print(name + ' net cps: ' + str(np.round(res[name], 3)) + ' +- ' + str(np.round(res[name + 'Err'], 3)))
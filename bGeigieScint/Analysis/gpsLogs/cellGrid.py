@@ -0,0 +1,123 @@
+import math
+import numpy as np
+
+from logArrays import SPECTRUM_LEN, defaultEcal
+
+latMid = 44.3824419
+dX = 100
+dY = 80
+
+# uSv/h per keV/s deposited in the 4.51 g/cm3 x 3 cm3 crystal, the dose
+# formula of logsGroupFoliumPlots.py
+doseFactor = 1.6021773e-16 * 1e6 / (4.51 * 3.0 * 1e-3) * 3600.0
+
+KEY_SHIFT = 2 ** 32
+KEY_OFFSET = 2 ** 31
+
+
+def metresPerDegree(latMid=latMid):
+    # Same formula as logsGroupFoliumPlots.py, so cells line up with the old maps
+    m_per_deg_lat = 111132.954 - 559.822 * math.cos(2 * latMid) + 1.175 * math.cos(4 * latMid)
+    m_per_deg_lon = 111132.954 * math.cos(latMid)
+    return m_per_deg_lat, m_per_deg_lon
+
+
+def gridSpacing(latMid=latMid, dX=dX, dY=dY):
+    m_per_deg_lat, m_per_deg_lon = metresPerDegree(latMid)
+    return dY / m_per_deg_lat, dX / m_per_deg_lon
+
+
+def cellMetres(grid, latMid=latMid):
+    # (dY, dX) size of a grid cell in metres, the inverse of gridSpacing
+    m_per_deg_lat, m_per_deg_lon = metresPerDegree(latMid)
+    return grid[0] * m_per_deg_lat, grid[1] * m_per_deg_lon
+
+
+def cellIndex(lat, lon, grid):
+    # int() truncation, as in the map script
+    iLat = np.trunc(np.asarray(lat) / grid[0]).astype(np.int64)
+    iLon = np.trunc(np.asarray(lon) / grid[1]).astype(np.int64)
+    return iLat, iLon
+
+
+def cellKey(iLat, iLon):
+    # One sortable int64 per cell, ordered by latitude row then longitude
+    return np.asarray(iLat, np.int64) * KEY_SHIFT + (np.asarray(iLon, np.int64) + KEY_OFFSET)
+
+
+def keyToIndex(key):
+    key = np.asarray(key, np.int64)
+    return key // KEY_SHIFT, key % KEY_SHIFT - KEY_OFFSET
+
+
+def cellCorner(key, grid):
+    iLat, iLon = keyToIndex(key)
+    return iLat * grid[0], iLon * grid[1]
+
+
+def recordKeys(recs, grid):
+    return cellKey(*cellIndex(recs['lat'], recs['lon'], grid))
+
+
+def mapRecordMask(recs):
+    # Records the map script uses, GPS fix and 1 second acquisitions
+    # (time 0 counts as 1 second)
+    return (recs['fix'] == 1) & (recs['time'] <= 1)
+
+
+def liveTime(recs):
+    return np.maximum(recs['time'], 1)
+
+
+def aggregateCells(keys, hist, time):
+    # Sums spectra and live time per cell. Cells come out sorted by key.
+    hist = np.asarray(hist)
+    ukeys, inv = np.unique(np.asarray(keys, np.int64), return_inverse=True)
+    inv = inv.reshape(-1)
+    cellHist = np.zeros((len(ukeys), hist.shape[1]), dtype=np.result_type(hist.dtype, np.int64))
+    np.add.at(cellHist, inv, hist)
+    return {
+        'key': ukeys,
+        'hist': cellHist,
+        'time': np.bincount(inv, weights=time, minlength=len(ukeys)),
+        'nRecords': np.bincount(inv, minlength=len(ukeys)),
+    }
+
+
+def mapCells(recs, grid):
+    # Cell aggregate of the records the map script uses
+    m = mapRecordMask(recs)
+    return aggregateCells(recordKeys(recs, grid)[m], recs['hist'][m], liveTime(recs)[m])
+
+
+def mergeCells(parts):
+    # Adds several cell aggregates on the same grid into one
+    parts = [p for p in parts if len(p['key'])]
+    if len(parts) == 0:
+        return {'key': np.zeros(0, np.int64), 'hist': np.zeros((0, SPECTRUM_LEN)),
+                'time': np.zeros(0), 'nRecords': np.zeros(0, np.int64)}
+    keys = np.concatenate([p['key'] for p in parts])
+    merged = aggregateCells(keys, np.concatenate([p['hist'] for p in parts]),
+                            np.concatenate([p['time'] for p in parts]))
+    inv = np.searchsorted(merged['key'], keys)
+    merged['nRecords'] = np.bincount(inv, weights=np.concatenate([p['nRecords'] for p in parts]),
+                                     minlength=len(merged['key'])).astype(np.int64)
+    return merged
+
+
+def channelKeV(ecal=defaultEcal, nChannels=SPECTRUM_LEN):
+    # keV per channel as used by the dose loop, the last channel is the
+    # overflow bin and carries no energy
+    i = np.arange(nChannels, dtype=np.float64)
+    keV = np.maximum(ecal[0] + ecal[1] * i + ecal[2] * i * i, 0.0)
+    keV[-1] = 0.0
+    return keV
+
+
+def doseRate(hist, time, keV=None):
+    # uSv/h from deposited energy in the 4.51 g/cm3 x 3 cm3 crystal,
+    # the formula from logsGroupFoliumPlots.py applied to all cells at once
+    hist = np.atleast_2d(hist)
+    if keV is None:
+        keV = channelKeV(nChannels=hist.shape[1])
+    return (hist @ keV) * doseFactor / np.asarray(time, dtype=np.float64)
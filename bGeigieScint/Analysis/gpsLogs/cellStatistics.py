@@ -0,0 +1,74 @@
+import numpy as np
+from scipy.stats import chi2, norm
+
+from logArrays import readRecords
+import cellGrid as cg
+
+# Counting statistics for every cell in one pass. Inputs are a cell
+# aggregate from cellGrid.aggregateCells and the keV per channel.
+
+def cellUncertainty(cells, keV=None, confidence=0.95, background=None):
+    # background is the expected count rate (cps) without a source, one value
+    # or one per cell. Defaults to the median gross rate of all cells.
+    hist = cells['hist']
+    t = np.asarray(cells['time'], dtype=np.float64)
+    if keV is None:
+        keV = cg.channelKeV(nChannels=hist.shape[1])
+    N = hist.sum(axis=1).astype(np.float64)
+    uSv = (hist @ keV) * cg.doseFactor / t
+    # dose is a weighted sum of Poisson counts, var = sum(keV^2 * n)
+    uSvErr = np.sqrt(hist @ (keV * keV)) * cg.doseFactor / t
+
+    # Garwood exact interval on the counts, carried over to the dose rate
+    # through the dose rate per count rate (uSv/h per cps) of the cell
+    a = 1.0 - confidence
+    nLo = np.where(N > 0, chi2.ppf(a / 2, 2 * N) / 2, 0.0)
+    nHi = chi2.ppf(1 - a / 2, 2 * N + 2) / 2
+    perCps = uSv * t / np.maximum(N, 1)
+    globalPerCps = (uSv * t).sum() / max(N.sum(), 1)
+    perCps = np.where(N > 0, perCps, globalPerCps)
+
+    if background is None:
+        background = np.median(N / t) if len(N) else 0.0
+    B = np.asarray(background, dtype=np.float64) * t
+    # Currie critical level and detection limit, in counts, for a well known
+    # background, false positive and false negative rates both 1 - confidence
+    kA = norm.ppf(confidence)
+    Lc = kA * np.sqrt(B)
+    Ld = kA * kA + 2 * Lc
+    net = N - B
+
+    return {
+        'counts': N,
+        'uSv': uSv,
+        'uSvErr': uSvErr,
+        'relErr': np.where(uSv > 0, uSvErr / np.where(uSv > 0, uSv, 1.0), np.inf),
+        'uSvLo': nLo / t * perCps,
+        'uSvHi': nHi / t * perCps,
+        'background': B,
+        'significance': np.where(B > 0, net / np.sqrt(np.where(B > 0, B, 1.0)), 0.0),
+        'detected': net > Lc,
+        # minimum detectable dose rate above background, using the average
+        # dose per count of the survey
+        'mdUSv': Ld / t * globalPerCps,
+    }
+
+
+def significanceOpacity(stats, maxOpacity=1.0):
+    # Dose scaled opacity as in the map script, faded by relative error so a
+    # cell with a few seconds of data stays pale
+    uSv = stats['uSv']
+    scaled = uSv / uSv.max() if len(uSv) and uSv.max() > 0 else uSv
+    return maxOpacity * scaled * np.clip(1.0 - stats['relErr'], 0.0, 1.0)
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    stats = cellUncertainty(cells)
+    opacity = significanceOpacity(stats)
+    for i in range(len(cells['key'])):
+        print('{0:.3f} +- {1:.3f} uSv/h [{2:.3f}, {3:.3f}], MDL {4:.3f}, z {5:.2f}, opacity {6:.2f}'.format(
+            stats['uSv'][i], stats['uSvErr'][i], stats['uSvLo'][i], stats['uSvHi'][i],
+            stats['mdUSv'][i], stats['significance'][i], opacity[i]))
@@ -0,0 +1,90 @@
+import sys
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from logArrays import SPECTRUM_LEN, readRecordChunks, readRecords, recordEpoch
+import cellGrid as cg
+
+# Parquet export of raw records and cell aggregates for pandas / DuckDB.
+# Columns are built straight from the NumPy arrays, spectra as fixed size
+# list columns over the flat histogram buffer, so no Python object is made
+# per row.
+
+recordColumns = [
+    ('lat', pa.float64()), ('lon', pa.float64()), ('alt', pa.float32()),
+    ('speed', pa.float32()), ('angle', pa.float32()), ('hdop', pa.float32()),
+    ('fix', pa.int8()), ('fixQ', pa.int8()), ('nSat', pa.int8()),
+    ('time', pa.int64()), ('counts', pa.int64()), ('temperature', pa.float32()),
+]
+
+
+def fixedSizeList(a, width, type):
+    return pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(a).reshape(-1), type=type), width)
+
+
+def recordSchema(nChannels=SPECTRUM_LEN):
+    return pa.schema([('timestamp', pa.timestamp('s', tz='UTC'))]
+                     + recordColumns
+                     + [('hist', pa.list_(pa.int32(), nChannels)),
+                        ('ecal', pa.list_(pa.float64(), 3)),
+                        ('sn', pa.string())])
+
+
+def recordBatch(recs, schema):
+    cols = [pa.array(recordEpoch(recs), type=pa.int64()).cast(schema.field('timestamp').type)]
+    cols += [pa.array(recs[name].astype(type.to_pandas_dtype()), type=type) for name, type in recordColumns]
+    cols += [fixedSizeList(recs['hist'].astype(np.int32), recs['hist'].shape[1], pa.int32()),
+             fixedSizeList(recs['ecal'], 3, pa.float64()),
+             pa.array(recs['sn'], type=pa.string())]
+    return pa.RecordBatch.from_arrays(cols, schema=schema)
+
+
+def writeRecordsParquet(dirs, path, rootDir='./', compression='zstd'):
+    # One row group per log file, streamed from the chunked reader
+    schema = recordSchema()
+    n = 0
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for chunk in readRecordChunks(dirs, rootDir):
+            if len(chunk['time']):
+                writer.write_batch(recordBatch(chunk, schema))
+                n += len(chunk['time'])
+    return n
+
+
+def cellTable(cells, grid, extra=None):
+    # extra is name -> per-cell array, e.g. dose rate or cellStatistics output
+    iLat, iLon = cg.keyToIndex(cells['key'])
+    lat, lon = cg.cellCorner(cells['key'], grid)
+    hist = np.asarray(cells['hist'])
+    histType = pa.int64() if np.issubdtype(hist.dtype, np.integer) else pa.float64()
+    cols = {
+        'key': pa.array(cells['key'], type=pa.int64()),
+        'iLat': pa.array(iLat, type=pa.int32()),
+        'iLon': pa.array(iLon, type=pa.int32()),
+        'lat': pa.array(lat),
+        'lon': pa.array(lon),
+        'latSize': pa.array(np.full(len(lat), grid[0])),
+        'lonSize': pa.array(np.full(len(lat), grid[1])),
+        'time': pa.array(np.asarray(cells['time'], np.float64)),
+        'nRecords': pa.array(np.asarray(cells['nRecords'], np.int64)),
+        'hist': fixedSizeList(hist.astype(histType.to_pandas_dtype()), hist.shape[1], histType),
+    }
+    for name, v in (extra or {}).items():
+        cols[name] = pa.array(np.asarray(v))
+    return pa.table(cols)
+
+
+def writeCellsParquet(cells, grid, path, extra=None, compression='zstd'):
+    pq.write_table(cellTable(cells, grid, extra), path, compression=compression)
+
+
+if __name__ == '__main__':
+    dirs = sys.argv[1:] if len(sys.argv) > 1 else ['G0000000']
+    n = writeRecordsParquet(dirs, 'records.parquet')
+    print('records written = ' + str(n))
+    recs, files = readRecords(dirs)
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    writeCellsParquet(cells, grid, 'cells.parquet', {'uSv': cg.doseRate(cells['hist'], cells['time'])})
+    print('cells written = ' + str(len(cells['key'])))
@@ -0,0 +1,80 @@
+import numpy as np
+
+from logArrays import SPECTRUM_LEN, defaultEcal, readRecords
+import cellGrid as cg
+
+# Spectrum to dose rate conversion. An engine turns the keV of every channel
+# into uSv/h per count per second; the resulting vector is cached per
+# calibration and applied to all cells as one matrix-vector product.
+
+# ICRP 74 ambient dose equivalent per photon fluence, H*(10)/phi in pSv cm2
+icrp74Kev = np.array([10, 15, 20, 30, 40, 50, 60, 80, 100, 150, 200, 300, 400, 500, 600,
+                      800, 1000, 1500, 2000, 3000, 4000, 5000, 6000, 8000, 10000], dtype=np.float64)
+icrp74H10 = np.array([0.061, 0.83, 1.05, 0.81, 0.64, 0.55, 0.51, 0.53, 0.61, 0.89, 1.20, 1.80, 2.38,
+                      2.93, 3.44, 4.38, 5.20, 6.90, 8.60, 11.1, 13.4, 15.5, 17.6, 21.6, 25.6])
+
+conversionCache = {}
+
+
+def logInterp(x, xp, fp):
+    # log-log interpolation, clamped to the end values of the table
+    x = np.clip(np.asarray(x, dtype=np.float64), xp[0], xp[-1])
+    return np.exp(np.interp(np.log(x), np.log(xp), np.log(fp)))
+
+
+def depositedEngine(keV):
+    # Energy deposited in the 4.51 g/cm3 x 3 cm3 crystal, the original map formula
+    return keV * cg.doseFactor
+
+
+def gEngine(keV, gKev, gValue):
+    # Tabulated G(E), uSv/h per count per second at deposited energy E
+    return np.where(keV > 0, logInterp(keV, gKev, gValue), 0.0)
+
+
+def fluxToDoseEngine(keV, effKev, efficiency, area, h10Kev=icrp74Kev, h10=icrp74H10):
+    # Full-energy approximation: a count at E is a photon of energy E, the
+    # fluence rate is cps / (efficiency(E) * area cm2), weighted by H*(10)/phi
+    eff = logInterp(keV, effKev, efficiency)
+    h = logInterp(keV, h10Kev, h10)
+    return np.where(keV > 0, h * 1e-6 * 3600.0 / (eff * area), 0.0)
+
+
+doseEngines = {
+    'deposited': depositedEngine,
+    'gE': gEngine,
+    'fluxToDose': fluxToDoseEngine,
+}
+
+
+def tableKey(value):
+    if isinstance(value, (np.ndarray, list, tuple)):
+        return np.asarray(value, dtype=np.float64).tobytes()
+    return value
+
+
+def conversionVector(engine='deposited', ecal=defaultEcal, nChannels=SPECTRUM_LEN, keV=None, **table):
+    # keV overrides the calibration, e.g. for spectra already on a keV grid
+    key = (engine, 'ecal' if keV is None else 'keV', tableKey(ecal if keV is None else keV), nChannels,
+           tuple(sorted((k, tableKey(v)) for k, v in table.items())))
+    vec = conversionCache.get(key)
+    if vec is None:
+        if keV is None:
+            keV = cg.channelKeV(ecal, nChannels)
+        vec = doseEngines[engine](np.asarray(keV, dtype=np.float64), **table)
+        conversionCache[key] = vec
+    return vec
+
+
+def cellDoseRate(cells, vec):
+    # uSv/h for every cell
+    return (cells['hist'] @ vec) / np.asarray(cells['time'], dtype=np.float64)
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    vec = conversionVector('deposited')
+    print('deposited: ' + str(cellDoseRate(cells, vec)))
+    print('map script formula: ' + str(cg.doseRate(cells['hist'], cells['time'])))
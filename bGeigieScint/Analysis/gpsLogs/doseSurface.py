@@ -0,0 +1,115 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from logArrays import readRecords
+import cellGrid as cg
+
+
+def toMetres(lat, lon, grid, dX=cg.dX, dY=cg.dY):
+    # Local plane where one cell is dX by dY metres
+    return np.asarray(lon) / grid[1] * dX, np.asarray(lat) / grid[0] * dY
+
+
+def toLatLon(x, y, grid, dX=cg.dX, dY=cg.dY):
+    return np.asarray(y) / dY * grid[0], np.asarray(x) / dX * grid[1]
+
+
+class CellInterpolator:
+    # KD-tree over the cell centroids, built once and reused for every
+    # radius, power or kriging range asked of it.
+
+    def __init__(self, keys, values, grid):
+        self.grid = grid
+        lat, lon = cg.cellCorner(keys, grid)
+        x, y = toMetres(lat + 0.5 * grid[0], lon + 0.5 * grid[1], grid)
+        self.points = np.column_stack([x, y])
+        self.values = np.asarray(values, dtype=np.float64)
+        self.tree = cKDTree(self.points)
+
+    def raster(self, pixel=20.0, margin=200.0):
+        # Regular raster over the bounding box of the cells, in metres
+        lo = self.points.min(axis=0) - margin
+        hi = self.points.max(axis=0) + margin
+        xs = np.arange(lo[0], hi[0] + pixel, pixel)
+        ys = np.arange(hi[1], lo[1] - pixel, -pixel)
+        return np.meshgrid(xs, ys)
+
+    def neighbours(self, X, Y, k, radius):
+        k = min(k, len(self.values))
+        d, idx = self.tree.query(np.column_stack([X.ravel(), Y.ravel()]), k=k,
+                                 distance_upper_bound=radius)
+        return d.reshape(-1, k), idx.reshape(-1, k)
+
+    def idw(self, X, Y, radius=300.0, power=2.0, k=12):
+        # Inverse-distance weighting of the k nearest cells within radius,
+        # NaN where there are none
+        d, idx = self.neighbours(X, Y, k, radius)
+        found = np.isfinite(d)
+        w = np.where(found, 1.0 / np.maximum(d, 1e-6) ** power, 0.0)
+        v = np.where(found, self.values[np.minimum(idx, len(self.values) - 1)], 0.0)
+        wSum = w.sum(axis=1)
+        out = np.full(len(d), np.nan)
+        ok = wSum > 0
+        out[ok] = (w * v).sum(axis=1)[ok] / wSum[ok]
+        return out.reshape(X.shape)
+
+    def simpleKriging(self, X, Y, corrRange=200.0, nugget=0.1, radius=600.0, k=12, chunk=65536):
+        # Simple kriging around the cell mean with an exponential covariance.
+        # Raster points are solved as batches of k x k systems, chunked to
+        # bound memory.
+        xs, ys = X.ravel(), Y.ravel()
+        out = np.empty(len(xs))
+        for s in range(0, len(xs), chunk):
+            d, idx = self.neighbours(xs[s:s + chunk], ys[s:s + chunk], k, radius)
+            out[s:s + chunk] = self.krigeBatch(d, idx, corrRange, nugget)
+        return out.reshape(X.shape)
+
+    def krigeBatch(self, d, idx, corrRange, nugget):
+        mean = self.values.mean()
+        sill = max(self.values.var(), 1e-12)
+        found = np.isfinite(d)
+        idx = np.minimum(idx, len(self.values) - 1)
+        p = self.points[idx]
+        dd = np.linalg.norm(p[:, :, None, :] - p[:, None, :, :], axis=-1)
+        C = sill * np.exp(-dd / corrRange)
+        C += np.eye(C.shape[-1]) * sill * nugget
+        # missing neighbours become uncorrelated dummies with zero weight
+        pair = found[:, :, None] & found[:, None, :]
+        C = np.where(pair, C, np.eye(C.shape[-1]) * sill)
+        c0 = np.where(found, sill * np.exp(-np.where(found, d, 0.0) / corrRange), 0.0)
+        w = np.linalg.solve(C, c0[..., None])[..., 0]
+        resid = np.where(found, self.values[idx] - mean, 0.0)
+        out = mean + (w * resid).sum(axis=1)
+        out[~found.any(axis=1)] = np.nan
+        return out
+
+
+def addSurfaceLayer(m, X, Y, surface, grid, name='interpolated dose rate'):
+    # Red overlay with opacity scaled by dose, like the cell rectangles
+    import folium
+    vMax = np.nanmax(surface)
+    rgba = np.zeros(surface.shape + (4,))
+    rgba[..., 0] = 1.0
+    rgba[..., 3] = np.nan_to_num(surface / vMax) * 0.8
+    lat, lon = toLatLon(X, Y, grid)
+    folium.raster_layers.ImageOverlay(
+        image=rgba,
+        bounds=[[lat.min(), lon.min()], [lat.max(), lon.max()]],
+        name=name,
+    ).add_to(m)
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    uSv = cg.doseRate(cells['hist'], cells['time'])
+
+    interp = CellInterpolator(cells['key'], uSv, grid)
+    X, Y = interp.raster()
+    for power in (1.0, 2.0, 3.0):
+        s = interp.idw(X, Y, power=power)
+        print('idw power ' + str(power) + ': ' + str(np.nanmin(s)) + ' .. ' + str(np.nanmax(s)))
+    s = interp.simpleKriging(X, Y)
+    print('kriging: ' + str(np.nanmin(s)) + ' .. ' + str(np.nanmax(s)))
+    print('raster = ' + str(X.shape) + ', filled ' + str(np.isfinite(s).sum()))
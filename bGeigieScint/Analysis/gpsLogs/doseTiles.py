@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from logArrays import readRecords
+from pngWriter import encodePng
+from waterfall import colormapLut
+import cellGrid as cg
+
+# Static z/x/y PNG tiles of the cell grid for slippy-map viewers, so large
+# surveys can be browsed offline without thousands of vector rectangles.
+# Only tiles touched by a cell are written, and a manifest of per-tile
+# digests lets a later run rewrite just the tiles whose cells changed.
+
+TILE = 256
+
+
+def lonToX(lon, z):
+    # global web mercator pixel coordinates at zoom z
+    return (np.asarray(lon, np.float64) + 180.0) / 360.0 * (TILE << z)
+
+
+def latToY(lat, z):
+    phi = np.radians(np.asarray(lat, np.float64))
+    return (1.0 - np.log(np.tan(phi) + 1.0 / np.cos(phi)) / np.pi) / 2.0 * (TILE << z)
+
+
+def xToLon(x, z):
+    return np.asarray(x, np.float64) / (TILE << z) * 360.0 - 180.0
+
+
+def yToLat(y, z):
+    return np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y, np.float64) / (TILE << z)))))
+
+
+def doseLevels(uSv, vMin=0.01, vMax=10.0):
+    # 0..255 colour index on a log scale, fixed bounds so that a tile only
+    # changes when its own cells do
+    v = np.clip(np.log(np.maximum(uSv, vMin) / vMin) / np.log(vMax / vMin), 0.0, 1.0)
+    return (v * 255).astype(np.uint8)
+
+
+def tileCells(keys, grid, z):
+    # (tile, cell) pairs for every tile a cell rectangle overlaps, sorted by
+    # tile. Tiles are packed as x * 2^32 + y.
+    lat0, lon0 = cg.cellCorner(keys, grid)
+    tx0 = (lonToX(lon0, z) // TILE).astype(np.int64)
+    tx1 = (lonToX(lon0 + grid[1], z) // TILE).astype(np.int64)
+    ty0 = (latToY(lat0 + grid[0], z) // TILE).astype(np.int64)
+    ty1 = (latToY(lat0, z) // TILE).astype(np.int64)
+    tiles, cells = [], []
+    for dx in range(int((tx1 - tx0).max()) + 1 if len(keys) else 0):
+        for dy in range(int((ty1 - ty0).max()) + 1):
+            m = (tx0 + dx <= tx1) & (ty0 + dy <= ty1)
+            tiles.append(((tx0 + dx) << 32 | (ty0 + dy))[m])
+            cells.append(np.nonzero(m)[0])
+    tiles = np.concatenate(tiles) if tiles else np.zeros(0, np.int64)
+    cells = np.concatenate(cells) if cells else np.zeros(0, np.int64)
+    order = np.lexsort((cells, tiles))
+    return tiles[order], cells[order]
+
+
+def renderTile(z, tx, ty, keys, levels, cells, grid, lut):
+    # Pixel centres are looked up in the sorted keys, with cells placed on
+    # the floor of lat/lon over the cell size like the map rectangles. Cells
+    # smaller than a pixel are added at their centre so none disappear when
+    # zoomed out.
+    px = tx * TILE + np.arange(TILE) + 0.5
+    py = ty * TILE + np.arange(TILE) + 0.5
+    iLon = np.floor(xToLon(px, z) / grid[1]).astype(np.int64)
+    iLat = np.floor(yToLat(py, z) / grid[0]).astype(np.int64)
+    k = cg.cellKey(iLat[:, None], iLon[None, :])
+    pos = np.minimum(np.searchsorted(keys, k), len(keys) - 1)
+    idx = np.where(keys[pos] == k, levels[pos].astype(np.int16), -1)
+
+    lat0, lon0 = cg.cellCorner(keys[cells], grid)
+    cx = (lonToX(lon0 + grid[1] / 2, z) - tx * TILE).astype(np.int64)
+    cy = (latToY(lat0 + grid[0] / 2, z) - ty * TILE).astype(np.int64)
+    inside = (cx >= 0) & (cx < TILE) & (cy >= 0) & (cy < TILE)
+    np.maximum.at(idx, (cy[inside], cx[inside]), levels[cells[inside]].astype(np.int16))
+
+    img = np.zeros((TILE, TILE, 4), np.uint8)
+    img[..., :3] = lut[np.maximum(idx, 0)]
+    img[..., 3] = np.where(idx >= 0, 200, 0)
+    return img
+
+
+def renderLevel(z, keys, levels, grid, outDir, old):
+    # Writes the changed tiles of one zoom level, removes tiles that no
+    # longer have data. Returns the level's manifest entries and the
+    # number of tiles written.
+    lut = colormapLut()
+    tiles, cells = tileCells(keys, grid, z)
+    uTiles, starts = np.unique(tiles, return_index=True)
+    bounds = np.append(starts, len(tiles))
+    manifest, written = {}, 0
+    for j, t in enumerate(uTiles):
+        tx, ty = int(t >> 32), int(t & 0xffffffff)
+        c = cells[bounds[j]:bounds[j + 1]]
+        name = '{0}/{1}/{2}'.format(z, tx, ty)
+        digest = hashlib.sha1(keys[c].tobytes() + levels[c].tobytes()).hexdigest()
+        manifest[name] = digest
+        path = os.path.join(outDir, name + '.png')
+        if old.get(name) == digest and os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(encodePng(renderTile(z, tx, ty, keys, levels, c, grid, lut)))
+        written += 1
+    for name in old:
+        if name not in manifest:
+            path = os.path.join(outDir, name + '.png')
+            if os.path.exists(path):
+                os.remove(path)
+    return manifest, written
+
+
+def writeTiles(outDir, keys, uSv, grid, zooms=range(8, 17), vMin=0.01, vMax=10.0, workers=None):
+    # keys sorted, as cell aggregates are. One worker per zoom level.
+    keys = np.asarray(keys, np.int64)
+    levels = doseLevels(uSv, vMin, vMax)
+    manifestPath = os.path.join(outDir, 'manifest.json')
+    old = {}
+    if os.path.exists(manifestPath):
+        with open(manifestPath) as f:
+            old = json.load(f)
+    os.makedirs(outDir, exist_ok=True)
+    manifest, written = {}, 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for z in zooms:
+            prefix = str(z) + '/'
+            oldLevel = {k: v for k, v in old.items() if k.startswith(prefix)}
+            futures.append(pool.submit(renderLevel, z, keys, levels, grid, outDir, oldLevel))
+        for f in futures:
+            part, n = f.result()
+            manifest.update(part)
+            written += n
+    with open(manifestPath, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    return written, len(manifest)
+
+
+def addTileLayer(m, outDir, name='dose rate tiles', maxZoom=16):
+    import folium
+    folium.TileLayer(
+        tiles=outDir.rstrip('/') + '/{z}/{x}/{y}.png',
+        attr='bGeigieScint',
+        name=name,
+        overlay=True,
+        max_native_zoom=maxZoom,
+    ).add_to(m)
+
+
+if __name__ == '__main__':
+    outDir = sys.argv[1] if len(sys.argv) > 1 else 'tiles'
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    uSv = cg.doseRate(cells['hist'], cells['time'])
+    written, total = writeTiles(outDir, cells['key'], uSv, grid)
+    print(str(written) + ' of ' + str(total) + ' tiles written to ' + outDir)
@@ -0,0 +1,89 @@
+import numpy as np
+import scipy.sparse as sp
+
+from logArrays import SPECTRUM_LEN, readRecords
+
+# Common output grid, 3 keV wide bins up to 3 MeV
+kevEdgesDefault = np.arange(0.0, 3000.0 + 3.0, 3.0)
+
+rebinCache = {}
+
+
+def channelEdgesKeV(ecal, nChannels=SPECTRUM_LEN):
+    # Channel i spans [i, i+1) ADC units, E = c0 + c1*x + c2*x^2. Energies
+    # below zero are clamped like the dose loop in logsGroupFoliumPlots.py.
+    x = np.arange(nChannels + 1, dtype=np.float64)
+    e = ecal[0] + ecal[1] * x + ecal[2] * x * x
+    return np.maximum(e, 0.0)
+
+
+def overlapMatrix(srcEdges, dstEdges):
+    # Sparse (nSrc, nDst) matrix, entry = fraction of source bin i that
+    # overlaps destination bin j, assuming counts are flat across a bin.
+    srcEdges = np.asarray(srcEdges, dtype=np.float64)
+    dstEdges = np.asarray(dstEdges, dtype=np.float64)
+    lo = np.minimum(srcEdges[:-1], srcEdges[1:])
+    hi = np.maximum(srcEdges[:-1], srcEdges[1:])
+    nSrc = len(lo)
+    nBins = len(dstEdges) - 1
+
+    first = np.clip(np.searchsorted(dstEdges, lo, 'right') - 1, 0, nBins)
+    last = np.clip(np.searchsorted(dstEdges, hi, 'left') - 1, -1, nBins - 1)
+    # zero width channels (everything clamped to 0 keV) go whole into their bin
+    inGrid = (lo >= dstEdges[0]) & (lo < dstEdges[-1])
+    last = np.where((hi == lo) & inGrid, first, last)
+    span = np.maximum(last - first + 1, 0)
+
+    rows = np.repeat(np.arange(nSrc), span)
+    offs = np.arange(span.sum()) - np.repeat(np.cumsum(span) - span, span)
+    cols = np.repeat(first, span) + offs
+
+    overlap = np.minimum(hi[rows], dstEdges[cols + 1]) - np.maximum(lo[rows], dstEdges[cols])
+    width = hi[rows] - lo[rows]
+    frac = np.where(width > 0, overlap / np.where(width > 0, width, 1.0), 1.0)
+    keep = frac > 0
+    return sp.csr_matrix((frac[keep], (rows[keep], cols[keep])), shape=(nSrc, nBins))
+
+
+def buildRebinMatrix(ecal, kevEdges, nChannels=SPECTRUM_LEN):
+    # The last channel is the overflow bin, it has no energy (as in
+    # cellGrid.channelKeV and the map script) and its row is left empty
+    edges = channelEdgesKeV(ecal, nChannels)[:nChannels]
+    M = overlapMatrix(edges, kevEdges)
+    return sp.vstack([M, sp.csr_matrix((1, M.shape[1]))], format='csr')
+
+
+def rebinMatrix(ecal, kevEdges=kevEdgesDefault, nChannels=SPECTRUM_LEN):
+    key = (tuple(float(c) for c in ecal), kevEdges.tobytes(), nChannels)
+    M = rebinCache.get(key)
+    if M is None:
+        M = buildRebinMatrix(ecal, kevEdges, nChannels)
+        rebinCache[key] = M
+    return M
+
+
+def rebinSpectra(hist, ecal, kevEdges=kevEdgesDefault):
+    # hist is (n, nChannels), ecal is (n, 3) or a single (3,) calibration.
+    # Rows sharing a calibration are rebinned together with one sparse product.
+    hist = np.atleast_2d(hist)
+    ecal = np.asarray(ecal, dtype=np.float64)
+    if ecal.ndim == 1:
+        ecal = np.broadcast_to(ecal, (hist.shape[0], 3))
+    out = np.zeros((hist.shape[0], len(kevEdges) - 1))
+    if hist.shape[0] == 0:
+        return out
+    cals, inv = np.unique(ecal, axis=0, return_inverse=True)
+    inv = inv.reshape(-1)
+    for c in range(len(cals)):
+        idx = np.nonzero(inv == c)[0]
+        M = rebinMatrix(cals[c], kevEdges, hist.shape[1])
+        out[idx] = (M.T @ hist[idx].T).T
+    return out
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    kev = rebinSpectra(recs['hist'], recs['ecal'])
+    print('records = ' + str(len(kev)))
+    print('calibrations cached = ' + str(len(rebinCache)))
+    print('counts in (without overflow) / out = ' + str(recs['hist'][:, :-1].sum()) + ' / ' + str(kev.sum()))
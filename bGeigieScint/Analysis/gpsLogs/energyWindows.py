@@ -0,0 +1,77 @@
+import numpy as np
+
+from logArrays import defaultEcal, readRecords
+from energyRebin import channelEdgesKeV
+import cellGrid as cg
+
+# Energy window counts for all cells from a prefix sum over the channel
+# axis. The cumulative array is built once per cell aggregate and kept in
+# it, after that any window is one subtraction.
+
+
+def cumulativeHist(cells):
+    # (nCells, nChannels + 1), column i is the sum of channels below i
+    cum = cells.get('cumHist')
+    if cum is None:
+        hist = cells['hist']
+        cum = np.zeros((hist.shape[0], hist.shape[1] + 1), dtype=np.result_type(hist.dtype, np.int64))
+        np.cumsum(hist, axis=1, out=cum[:, 1:])
+        cells['cumHist'] = cum
+    return cum
+
+
+def keVToChannels(loKeV, hiKeV, ecal=defaultEcal, nChannels=cg.SPECTRUM_LEN):
+    # [lo, hi) channel range of the channels whose lower edge is in the
+    # keV window, the overflow channel is never included
+    edges = channelEdgesKeV(ecal, nChannels)[:nChannels - 1]
+    return int(np.searchsorted(edges, loKeV, 'left')), int(np.searchsorted(edges, hiKeV, 'left'))
+
+
+def windowCounts(cells, lo, hi):
+    cum = cumulativeHist(cells)
+    return cum[:, hi] - cum[:, lo]
+
+
+def windowCountsKeV(cells, loKeV, hiKeV, ecal=defaultEcal):
+    lo, hi = keVToChannels(loKeV, hiKeV, ecal, cells['hist'].shape[1])
+    return windowCounts(cells, lo, hi)
+
+
+def windowRates(cells, windows, ecal=defaultEcal):
+    # name -> cps per cell, windows is name -> (loKeV, hiKeV)
+    t = np.asarray(cells['time'], dtype=np.float64)
+    return {name: windowCountsKeV(cells, lo, hi, ecal) / t for name, (lo, hi) in windows.items()}
+
+
+def addWindowLayers(m, cells, grid, windows, ecal=defaultEcal, color='red'):
+    # One folium layer per window, rectangles styled like the map script
+    import folium
+    lat, lon = cg.cellCorner(cells['key'], grid)
+    for name, rate in windowRates(cells, windows, ecal).items():
+        layer = folium.FeatureGroup(name=name, show=False)
+        rMax = rate.max() if len(rate) and rate.max() > 0 else 1.0
+        for i in range(len(rate)):
+            folium.Rectangle(
+                bounds=[[lat[i], lon[i]], [lat[i] + grid[0], lon[i] + grid[1]]],
+                color="black",
+                weight=0.5,
+                opacity=1,
+                fill=True,
+                fill_color=color,
+                fill_opacity=float(rate[i] / rMax),
+                tooltip="{0}: {1:.3f} cps".format(name, rate[i]),
+            ).add_to(layer)
+        layer.add_to(m)
+    folium.LayerControl().add_to(m)
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    windows = {'600-720 keV': (600.0, 720.0), 'above 1400 keV': (1400.0, 1e9)}
+    for name, rate in windowRates(cells, windows).items():
+        print(name + ': ' + str(np.round(rate, 4)) + ' cps')
+    lo, hi = keVToChannels(600.0, 720.0)
+    print('channels ' + str(lo) + '..' + str(hi) + ', check ' + str(np.array_equal(
+        windowCounts(cells, lo, hi), cells['hist'][:, lo:hi].sum(axis=1))))
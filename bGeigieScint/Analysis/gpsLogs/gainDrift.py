@@ -0,0 +1,96 @@
+import numpy as np
+
+from logArrays import readRecords
+import scipy.sparse as sp
+
+from energyRebin import overlapMatrix, rebinCache
+
+# Gain model, g(T) = 1 + slope * (T - tRef), with g the ratio between the
+# channel a line lands in at T and the channel it lands in at tRef. Either
+# fitted from the logs by fitGainModel or written by hand, e.g.
+#   gainModel = {'tRef': 20.0, 'slope': -0.004}
+gainGridDefault = np.arange(0.85, 1.15 + 1e-9, 0.0025)
+
+
+def gainAt(model, temperature):
+    return 1.0 + model['slope'] * (np.asarray(temperature, dtype=np.float64) - model['tRef'])
+
+
+def temperatureBuckets(temperature, bucketWidth):
+    # Integer bucket index per record and the centre temperature of each bucket
+    b = np.floor(np.asarray(temperature) / bucketWidth).astype(np.int64)
+    keys, inv = np.unique(b, return_inverse=True)
+    return inv.reshape(-1), (keys + 0.5) * bucketWidth
+
+
+def stretchMatrix(gain, nChannels):
+    # Moves channel x to x / gain with linear (overlap) interpolation, cached
+    # alongside the energy rebin matrices. The last (overflow) channel is
+    # carried over unchanged and counts stretched past the top stay in the
+    # last regular channel, so totals are kept.
+    key = ('stretch', float(gain), nChannels)
+    M = rebinCache.get(key)
+    if M is None:
+        n = nChannels - 1
+        src = np.arange(n + 1, dtype=np.float64) / gain
+        dst = np.arange(n + 1, dtype=np.float64)
+        dst[-1] = np.inf
+        M = sp.block_diag([overlapMatrix(src, dst), sp.identity(1)], format='csr')
+        rebinCache[key] = M
+    return M
+
+
+def fitGainModel(hist, temperature, tRef=None, bucketWidth=1.0, minChannel=80,
+                 gainGrid=gainGridDefault):
+    # Sums spectra per temperature bucket, then finds the stretch of the
+    # reference bucket that best matches every other bucket in one matrix
+    # product over all candidate gains. slope is fitted through g(tRef) = 1.
+    hist = np.asarray(hist)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    nCh = hist.shape[1]
+    inv, tCentre = temperatureBuckets(temperature, bucketWidth)
+    sums = np.zeros((len(tCentre), nCh))
+    np.add.at(sums, inv, hist)
+    sums[:, :minChannel] = 0
+    sums[:, -1] = 0
+
+    if tRef is None:
+        tRef = float(np.average(temperature, weights=hist.sum(axis=1) + 1))
+    ref = sums[np.argmin(np.abs(tCentre - tRef))]
+
+    # candidate spectra, what the reference would look like at gain g
+    cand = np.stack([stretchMatrix(1.0 / g, nCh).T @ ref for g in gainGrid])
+    cand /= np.linalg.norm(cand, axis=1, keepdims=True) + 1e-12
+    score = cand @ (sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)).T
+    gain = gainGrid[np.argmax(score, axis=0)]
+
+    w = sums.sum(axis=1)
+    dT = tCentre - tRef
+    den = np.sum(w * dT * dT)
+    slope = float(np.sum(w * dT * (gain - 1.0)) / den) if den > 0 else 0.0
+    return {'tRef': tRef, 'slope': slope}
+
+
+def correctGainDrift(hist, temperature, model, bucketWidth=0.25):
+    # Records are grouped by temperature bucket, each bucket is stretched
+    # back to tRef with one sparse product using its precomputed weights.
+    hist = np.asarray(hist)
+    out = np.zeros(hist.shape)
+    if hist.shape[0] == 0:
+        return out
+    inv, tCentre = temperatureBuckets(temperature, bucketWidth)
+    gains = gainAt(model, tCentre)
+    for b in range(len(tCentre)):
+        idx = np.nonzero(inv == b)[0]
+        M = stretchMatrix(gains[b], hist.shape[1])
+        out[idx] = (M.T @ hist[idx].T).T
+    return out
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    model = fitGainModel(recs['hist'], recs['temperature'])
+    print('gain model = ' + str(model))
+    corrected = correctGainDrift(recs['hist'], recs['temperature'], model)
+    print('temperature range = ' + str(recs['temperature'].min()) + ' .. ' + str(recs['temperature'].max()))
+    print('counts in / out = ' + str(recs['hist'].sum()) + ' / ' + str(corrected.sum()))
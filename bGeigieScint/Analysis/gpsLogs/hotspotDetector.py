@@ -0,0 +1,143 @@
+import json as js
+import math
+import sys
+import time as systime
+
+from logArrays import defaultEcal, logFilesOf, prefetchFiles
+from logIntegrity import checkedRecords, validRecord
+from backgroundSubtract import roisDefault
+from energyWindows import keVToChannels
+
+# Sequential hotspot detection along the drive track. Each record costs the
+# same whatever the length of the drive: an exponentially weighted background
+# rate and a Poisson CUSUM per count stream.
+
+
+class PoissonCusum:
+    # One-sided Poisson CUSUM testing for a rate ratio of k over background.
+    # The background is an exponentially weighted mean rate with time
+    # constant tau seconds, frozen while the CUSUM is above zero so a source
+    # does not raise its own background.
+
+    def __init__(self, k=2.0, h=8.0, tau=60.0, warmup=10.0):
+        self.k = k
+        self.h = h
+        self.tau = tau
+        self.warmup = warmup
+        self.logK = math.log(k)
+        self.rate = 0.0
+        self.seen = 0.0
+        self.s = 0.0
+
+    def update(self, counts, t):
+        if self.seen < self.warmup:
+            self.rate = (self.rate * self.seen + counts) / (self.seen + t)
+            self.seen += t
+            return False
+        mu = max(self.rate, 1e-3) * t
+        self.s = max(0.0, self.s + counts * self.logK - (self.k - 1.0) * mu)
+        if self.s == 0.0:
+            a = 1.0 - math.exp(-t / self.tau)
+            self.rate += a * (counts / t - self.rate)
+        if self.s > self.h:
+            self.s = 0.0
+            return True
+        return False
+
+
+class HotspotDetector:
+    # Feeds gross counts and every ROI (name -> (loKeV, hiKeV)) to their own
+    # CUSUM and returns alarm events with position. ROIs are mapped to
+    # channels with each record's own calibration.
+
+    def __init__(self, rois=None, **cusumArgs):
+        self.rois = rois if rois is not None else {'Cs137': roisDefault['Cs137']}
+        self.channels = {}
+        self.streams = {'gross': PoissonCusum(**cusumArgs)}
+        for name in self.rois:
+            self.streams[name] = PoissonCusum(**cusumArgs)
+
+    def roiChannels(self, ecal, nChannels):
+        # name -> [first, last) channel, cached per calibration
+        key = (tuple(ecal), nChannels)
+        if key not in self.channels:
+            self.channels[key] = {name: keVToChannels(lo, hi, key[0], nChannels)
+                                  for name, (lo, hi) in self.rois.items()}
+        return self.channels[key]
+
+    def update(self, data):
+        sp = data['spectrum']
+        loc = data['location']
+        t = max(sp['time'], 1)
+        hist = sp['hist']
+        counts = {'gross': sum(hist)}
+        for name, (lo, hi) in self.roiChannels(sp.get('ecal', defaultEcal), len(hist)).items():
+            counts[name] = sum(hist[lo:hi])
+        events = []
+        for name, c in counts.items():
+            cusum = self.streams[name]
+            if cusum.update(c, t):
+                ts = data['timestamp']
+                events += [{
+                    'stream': name,
+                    'timestamp': '20{:02d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}'.format(
+                        ts['year'], ts['month'], ts['day'], ts['hour'], ts['minute'], ts['seconds']),
+                    'lat': loc['lat'] if loc['fix'] == 1 else None,
+                    'lon': loc['lon'] if loc['fix'] == 1 else None,
+                    'counts': c,
+                    'seconds': t,
+                    'background': cusum.rate * t,
+                }]
+        return events
+
+    def run(self, records):
+        for data in records:
+            for e in self.update(data):
+                yield e
+
+
+def logRecords(dirs, rootDir='./', workers=4):
+    # Decoded records of finished logs, file by file in name order, read
+    # through the integrity index so damaged lines are skipped
+    for f, data in prefetchFiles(logFilesOf(dirs, rootDir), workers):
+        for rec in checkedRecords(f, data):
+            yield rec
+
+
+def followRecords(path, poll=0.2):
+    # Decoded records of a file as the logger appends them. A partial last
+    # line is held back until its newline arrives; lines that still do not
+    # decode to a complete record (a restart mid-line) are skipped.
+    with open(path) as currentFile:
+        pending = ''
+        while True:
+            chunk = currentFile.readline()
+            if chunk == '':
+                systime.sleep(poll)
+                continue
+            pending += chunk
+            if not pending.endswith('\n'):
+                continue
+            line, pending = pending, ''
+            if not line.strip():
+                continue
+            try:
+                data = js.loads(line)
+            except ValueError:
+                continue
+            if validRecord(data):
+                yield data
+
+
+if __name__ == '__main__':
+    detector = HotspotDetector()
+    if len(sys.argv) > 1:
+        records = followRecords(sys.argv[1])
+    else:
+        records = logRecords(['G0000000'])
+    n = 0
+    for e in detector.run(records):
+        print('{timestamp} {stream}: {counts} counts in {seconds} s, background {background:.2f}, '
+              'at {lat}, {lon}'.format(**e))
+        n += 1
+    print('alarms = ' + str(n))
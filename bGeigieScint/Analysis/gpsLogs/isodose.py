@@ -0,0 +1,202 @@
+import sys
+import numpy as np
+
+from logArrays import readRecords
+from doseSurface import CellInterpolator, toLatLon
+import cellGrid as cg
+
+# Isodose lines from a dose rate raster. Marching squares runs on whole
+# arrays per level; the segments share their edge crossings, so they are
+# chained into polylines by matching edge ids, then thinned with
+# Douglas-Peucker.
+
+levelsDefault = (0.2, 0.5, 1.0)
+
+# edges of a raster cell: 0 top, 1 right, 2 bottom, 3 left. Corner bits are
+# 1 top left, 2 top right, 4 bottom right, 8 bottom left.
+caseSegments = {
+    1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)], 6: [(0, 2)], 7: [(3, 2)],
+    8: [(3, 2)], 9: [(0, 2)], 11: [(1, 2)], 12: [(3, 1)], 13: [(0, 1)], 14: [(3, 0)],
+}
+# saddles, by whether the cell centre is above the level
+saddleSegments = {
+    (5, True): [(0, 1), (3, 2)], (5, False): [(3, 0), (1, 2)],
+    (10, True): [(3, 0), (1, 2)], (10, False): [(0, 1), (3, 2)],
+}
+
+
+def marchingSegments(v, level):
+    # Returns (segments, points): segments is an (m, 2) array of edge ids,
+    # points maps edge id -> (row, col) of the crossing. NaN counts as no
+    # dose, so lines close along the edge of the data.
+    v = np.nan_to_num(np.asarray(v, np.float64), nan=0.0)
+    ny, nx = v.shape
+    hi = v >= level
+    case = (hi[:-1, :-1] * 1 + hi[:-1, 1:] * 2 + hi[1:, 1:] * 4 + hi[1:, :-1] * 8).astype(np.uint8)
+    nH = ny * (nx - 1)
+    # edge ids: horizontal edge (i, j)-(i, j+1) is i * (nx - 1) + j, vertical
+    # edge (i, j)-(i+1, j) is nH + i * nx + j
+    rows, cols = np.nonzero((case != 0) & (case != 15))
+    c = case[rows, cols]
+    cellEdges = np.stack([rows * (nx - 1) + cols, nH + rows * nx + cols + 1,
+                          (rows + 1) * (nx - 1) + cols, nH + rows * nx + cols], axis=1)
+    segs = []
+    for k, pairs in caseSegments.items():
+        sel = c == k
+        for e0, e1 in pairs:
+            segs.append(cellEdges[sel][:, [e0, e1]])
+    centre = (v[rows, cols] + v[rows, cols + 1] + v[rows + 1, cols] + v[rows + 1, cols + 1]) / 4 >= level
+    for (k, up), pairs in saddleSegments.items():
+        sel = (c == k) & (centre == up)
+        for e0, e1 in pairs:
+            segs.append(cellEdges[sel][:, [e0, e1]])
+    segs = np.concatenate(segs) if segs else np.zeros((0, 2), np.int64)
+
+    # crossing point on every edge used, by linear interpolation
+    ids = np.unique(segs)
+    horiz = ids < nH
+    i = np.where(horiz, ids // (nx - 1), (ids - nH) // nx)
+    j = np.where(horiz, ids % (nx - 1), (ids - nH) % nx)
+    v0 = v[i, j]
+    v1 = np.where(horiz, v[i, np.minimum(j + 1, nx - 1)], v[np.minimum(i + 1, ny - 1), j])
+    t = (level - v0) / np.where(v1 != v0, v1 - v0, 1.0)
+    pts = np.column_stack([i + np.where(horiz, 0.0, t), j + np.where(horiz, t, 0.0)])
+    return segs, ids, pts
+
+
+def chainSegments(segs):
+    # Polylines as lists of edge ids. Every crossing belongs to at most two
+    # segments, so endpoints are linked by sorting them by edge id.
+    m = len(segs)
+    ends = segs.ravel()
+    order = np.argsort(ends, kind='stable')
+    same = ends[order[1:]] == ends[order[:-1]]
+    other = np.full(2 * m, -1, np.int64)
+    a, b = order[:-1][same], order[1:][same]
+    other[a], other[b] = b, a
+    other = other.tolist()
+    ends = ends.tolist()
+    used = [False] * m
+    lines = []
+
+    def walk(slot):
+        # slot is the endpoint we enter a segment by, 2 * segment + side
+        line = [ends[slot]]
+        while True:
+            s = slot >> 1
+            used[s] = True
+            out = slot ^ 1
+            line.append(ends[out])
+            nxt = other[out]
+            if nxt < 0 or used[nxt >> 1]:
+                return line
+            slot = nxt
+
+    # open lines from their free ends first, then the closed rings
+    for slot in range(2 * m):
+        if other[slot] < 0 and not used[slot >> 1]:
+            lines.append(walk(slot))
+    for s in range(m):
+        if not used[s]:
+            lines.append(walk(2 * s))
+    return lines
+
+
+def simplifyLine(pts, tolerance):
+    # Douglas-Peucker, iterative
+    n = len(pts)
+    if n < 3:
+        return pts
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        s, e = stack.pop()
+        if e - s < 2:
+            continue
+        p0, p1 = pts[s], pts[e]
+        d = p1 - p0
+        norm = np.hypot(d[0], d[1])
+        q = pts[s + 1:e] - p0
+        if norm > 0:
+            dist = np.abs(q[:, 0] * d[1] - q[:, 1] * d[0]) / norm
+        else:
+            dist = np.hypot(q[:, 0], q[:, 1])
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            keep[s + 1 + k] = True
+            stack += [(s, s + 1 + k), (s + 1 + k, e)]
+    return pts[keep]
+
+
+def contourLines(v, level, tolerance=0.5):
+    # Polylines in (row, col) raster coordinates, simplified to tolerance
+    # pixels
+    segs, ids, pts = marchingSegments(v, level)
+    out = []
+    for line in chainSegments(segs):
+        p = pts[np.searchsorted(ids, line)]
+        out.append(simplifyLine(p, tolerance))
+    return out
+
+
+def isodoseContours(X, Y, surface, grid, levels=levelsDefault, tolerance=0.5, minPoints=3):
+    # level -> list of (n, 2) lat/lon arrays, for a raster from
+    # CellInterpolator.raster or any regular grid of the same layout
+    xs, ys = X[0, :], Y[:, 0]
+    out = {}
+    for level in levels:
+        lines = []
+        for p in contourLines(surface, level, tolerance):
+            if len(p) < minPoints:
+                continue
+            x = np.interp(p[:, 1], np.arange(len(xs)), xs)
+            y = np.interp(p[:, 0], np.arange(len(ys)), ys)
+            lat, lon = toLatLon(x, y, grid)
+            lines.append(np.column_stack([lat, lon]))
+        out[level] = lines
+    return out
+
+
+def contoursGeoJson(contours):
+    # One MultiLineString feature per level, [lon, lat] order
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'properties': {'uSv': level},
+            'geometry': {
+                'type': 'MultiLineString',
+                'coordinates': [np.round(l[:, ::-1], 7).tolist() for l in lines],
+            },
+        } for level, lines in contours.items()],
+    }
+
+
+def addContourLayer(m, contours, colors=('yellow', 'orange', 'red'), name='isodose'):
+    import folium
+    levels = sorted(contours)
+    for k, level in enumerate(levels):
+        color = colors[min(k, len(colors) - 1)]
+        folium.GeoJson(
+            contoursGeoJson({level: contours[level]}),
+            name='{0} {1} uSv/h'.format(name, level),
+            style_function=lambda f, color=color: {'color': color, 'weight': 2},
+            tooltip='{0} uSv/h'.format(level),
+        ).add_to(m)
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    grid = cg.gridSpacing()
+    cells = cg.mapCells(recs, grid)
+    uSv = cg.doseRate(cells['hist'], cells['time'])
+    interp = CellInterpolator(cells['key'], uSv, grid)
+    X, Y = interp.raster()
+    s = interp.idw(X, Y)
+    # the sample survey is all background, so its own quantiles are drawn
+    # unless levels are given
+    levels = [float(a) for a in sys.argv[1:]] or list(np.round(np.nanpercentile(s, [50, 90]), 3))
+    contours = isodoseContours(X, Y, s, grid, levels)
+    for level, lines in contours.items():
+        print('{0} uSv/h: {1} lines, {2} points'.format(level, len(lines), sum(len(l) for l in lines)))
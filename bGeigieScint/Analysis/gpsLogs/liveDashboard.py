@@ -0,0 +1,187 @@
+import asyncio
+import json as js
+import os
+import sys
+import threading
+import time as systime
+import numpy as np
+import serial
+import websockets
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from logArrays import SPECTRUM_LEN, defaultEcal
+from doseConversion import conversionVector
+import cellGrid as cg
+
+# Live map while driving. The bGeigieScint is polled over USB CDC with the
+# 'h' command once a second, the difference to the previous cumulative
+# spectrum is paired with the latest NMEA fix from the GPS receiver, binned
+# into its cell, and the changed cell is pushed over a websocket to the
+# page served from this directory.
+#
+#   python liveDashboard.py /dev/ttyACM0 /dev/ttyUSB0
+#
+# then open http://localhost:8000/liveDashboard.html
+
+# firmware default ecal, meaning no calibration has been written
+FIRMWARE_ECAL = (0.0, 1.0, 0.0)
+
+
+class SpectrumPoller:
+
+    def __init__(self, port, baud=115200):
+        self.port = serial.Serial(port, baud, timeout=1.0)
+        self.last = None
+
+    def poll(self):
+        # One spectrum message, as the increment since the previous poll
+        self.port.reset_input_buffer()
+        self.port.write(b'h')
+        while True:
+            line = self.port.readline()
+            if not line:
+                return None
+            try:
+                msg = js.loads(line)
+            except ValueError:
+                continue
+            if msg.get('type') == 'spectrum':
+                break
+        p = msg['payload']
+        hist = np.asarray(p['data'], dtype=np.int64)
+        # 'time' is seconds, the RTC runs off the 1.024 kHz XOSC1K divided by 1024
+        seconds = p['time']
+        last, self.last = self.last, (hist, seconds)
+        if last is None:
+            return None
+        if seconds < last[1] or (hist < last[0]).any():
+            # acquisition restarted, the new spectrum is all increment
+            dHist, dSeconds = hist, seconds
+        else:
+            dHist, dSeconds = hist - last[0], seconds - last[1]
+        ecal = tuple(p.get('ecal', defaultEcal))
+        if np.allclose(ecal, FIRMWARE_ECAL):
+            ecal = defaultEcal
+        return {'sn': p.get('sn', ''), 'hist': dHist, 'seconds': dSeconds,
+                'temperature': p.get('temperature'), 'ecal': ecal}
+
+
+def nmeaDegrees(v, hemi):
+    if not v:
+        return None
+    d = float(v)
+    deg = int(d // 100)
+    out = deg + (d - deg * 100) / 60.0
+    return -out if hemi in ('S', 'W') else out
+
+
+class NmeaGps(threading.Thread):
+    # Latest fix from $GxGGA sentences, read in the background
+
+    def __init__(self, port, baud=9600):
+        super().__init__(daemon=True)
+        self.port = serial.Serial(port, baud, timeout=1.0)
+        self.fix = None
+
+    def run(self):
+        while True:
+            line = self.port.readline().decode('ascii', 'replace').strip()
+            f = line.split('*')[0].split(',')
+            if len(f) > 9 and f[0][3:] == 'GGA':
+                if f[6] not in ('', '0'):
+                    self.fix = {'lat': nmeaDegrees(f[2], f[3]), 'lon': nmeaDegrees(f[4], f[5]),
+                                'nSat': int(f[7] or 0), 'hdop': float(f[8] or 0), 'at': systime.time()}
+                else:
+                    self.fix = None
+
+
+class LiveCells:
+    # Cells grown one record at a time, key -> row in preallocated arrays
+
+    def __init__(self, grid, nChannels=SPECTRUM_LEN, capacity=4096):
+        self.grid = grid
+        self.index = {}
+        self.hist = np.zeros((capacity, nChannels))
+        self.time = np.zeros(capacity)
+        self.uSvTime = np.zeros(capacity)
+
+    def add(self, lat, lon, hist, seconds, vec):
+        key = int(cg.cellKey(*cg.cellIndex(lat, lon, self.grid)))
+        i = self.index.get(key)
+        if i is None:
+            i = len(self.index)
+            if i == len(self.time):
+                self.hist = np.concatenate([self.hist, np.zeros_like(self.hist)])
+                self.time = np.concatenate([self.time, np.zeros_like(self.time)])
+                self.uSvTime = np.concatenate([self.uSvTime, np.zeros_like(self.uSvTime)])
+            self.index[key] = i
+        self.hist[i] += hist
+        self.time[i] += seconds
+        # dose integral kept per cell, so calibration changes only affect new data
+        self.uSvTime[i] += float(hist @ vec)
+        return key
+
+    def message(self, key):
+        i = self.index[key]
+        lat, lon = cg.cellCorner(key, self.grid)
+        return {'key': key, 'bounds': [[float(lat), float(lon)],
+                                       [float(lat + self.grid[0]), float(lon + self.grid[1])]],
+                'uSv': self.uSvTime[i] / self.time[i], 'seconds': self.time[i],
+                'counts': int(self.hist[i].sum())}
+
+
+class Dashboard:
+
+    def __init__(self, poller, gps, grid, maxFixAge=2.0):
+        self.poller = poller
+        self.gps = gps
+        self.cells = LiveCells(grid)
+        self.clients = set()
+        self.maxFixAge = maxFixAge
+
+    async def client(self, ws):
+        self.clients.add(ws)
+        try:
+            # whole map first, then changes as they come
+            for key in list(self.cells.index):
+                await ws.send(js.dumps(self.cells.message(key)))
+            await ws.wait_closed()
+        finally:
+            self.clients.discard(ws)
+
+    def step(self):
+        rec = self.poller.poll()
+        fix = self.gps.fix
+        if rec is None or fix is None or systime.time() - fix['at'] > self.maxFixAge or rec['seconds'] <= 0:
+            return None
+        vec = conversionVector('deposited', rec['ecal'], len(rec['hist']))
+        return self.cells.add(fix['lat'], fix['lon'], rec['hist'], rec['seconds'], vec)
+
+    async def run(self, period=1.0):
+        while True:
+            t0 = systime.monotonic()
+            key = await asyncio.to_thread(self.step)
+            if key is not None and self.clients:
+                websockets.broadcast(self.clients, js.dumps(self.cells.message(key)))
+            await asyncio.sleep(max(0.0, period - (systime.monotonic() - t0)))
+
+
+def serveHttp(port):
+    # liveDashboard.html sits beside this script, wherever it is run from
+    pageDir = os.path.dirname(os.path.abspath(__file__))
+    server = ThreadingHTTPServer(('localhost', port), partial(SimpleHTTPRequestHandler, directory=pageDir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+async def main(devicePort, gpsPort, httpPort=8000, wsPort=8765):
+    gps = NmeaGps(gpsPort)
+    gps.start()
+    dash = Dashboard(SpectrumPoller(devicePort), gps, cg.gridSpacing())
+    serveHttp(httpPort)
+    async with websockets.serve(dash.client, 'localhost', wsPort):
+        await dash.run()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(sys.argv[1], sys.argv[2]))
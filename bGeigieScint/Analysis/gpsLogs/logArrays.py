@@ -0,0 +1,207 @@
+import json as js
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from os.path import join
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+SPECTRUM_LEN = 1024
+
+# ecal[3] = {c0, c1, c2}, E[keV] = c0 + c1*ch + c2*ch^2, same layout as the
+# firmware physicsParams. This is the linear calibration logsGroupFoliumPlots.py
+# has always used, and it is applied to records that do not carry their own.
+defaultEcal = (-201.57, 2.7676, 0.0)
+
+
+def listLogFiles(dir):
+    # Only the logger's .csv files, caches such as the integrity index and
+    # the trackSat tables sit beside them
+    with os.scandir(dir) as it:
+        return sorted(e.path for e in it if e.name.lower().endswith('.csv') and e.is_file())
+
+
+def readFile(path, blockSize=1 << 22):
+    # Whole file in a few large unbuffered reads, slow cards and network
+    # shares are latency bound on many small ones
+    with open(path, 'rb', buffering=0) as f:
+        size = os.fstat(f.fileno()).st_size
+        buf = bytearray(size)
+        view = memoryview(buf)
+        pos = 0
+        while pos < size:
+            n = f.readinto(view[pos:pos + blockSize])
+            if not n:
+                break
+            pos += n
+    return bytes(view[:pos])
+
+
+def prefetchFiles(paths, workers=4, depth=8):
+    # Yields (path, bytes) in order while up to depth files are being read
+    # ahead by a bounded thread pool, so reading overlaps parsing
+    paths = iter(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for p in paths:
+            pending.append((p, pool.submit(readFile, p)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            p, f = pending.popleft()
+            data = f.result()
+            nxt = next(paths, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(readFile, nxt)))
+            yield p, data
+
+
+def emptyRecords(n):
+    return {
+        'year': np.zeros(n, np.int16),
+        'month': np.zeros(n, np.int8),
+        'day': np.zeros(n, np.int8),
+        'hour': np.zeros(n, np.int8),
+        'minute': np.zeros(n, np.int8),
+        'seconds': np.zeros(n, np.int8),
+        'lat': np.zeros(n),
+        'lon': np.zeros(n),
+        'alt': np.zeros(n),
+        'speed': np.zeros(n),
+        'angle': np.zeros(n),
+        'hdop': np.zeros(n),
+        'fix': np.zeros(n, np.int8),
+        'fixQ': np.zeros(n, np.int8),
+        'nSat': np.zeros(n, np.int8),
+        'time': np.zeros(n, np.int64),
+        'counts': np.zeros(n, np.int64),
+        'temperature': np.zeros(n),
+        'hist': np.zeros((n, SPECTRUM_LEN), np.int32),
+        'ecal': np.tile(np.asarray(defaultEcal), (n, 1)),
+        'sn': np.full(n, '', dtype='<U32'),
+        'file': np.zeros(n, np.int32),
+    }
+
+
+def fillRecord(recs, i, data, fileIdx=0):
+    ts = data['timestamp']
+    loc = data['location']
+    sp = data['spectrum']
+    for k in ('year', 'month', 'day', 'hour', 'minute', 'seconds'):
+        recs[k][i] = ts[k]
+    for k in ('lat', 'lon', 'alt', 'speed', 'angle', 'hdop', 'fix', 'fixQ', 'nSat'):
+        recs[k][i] = loc.get(k, 0)
+    recs['time'][i] = sp['time']
+    recs['counts'][i] = sp['counts']
+    recs['temperature'][i] = sp['temperature']
+    recs['hist'][i] = sp['hist']
+    if 'ecal' in sp:
+        recs['ecal'][i] = sp['ecal']
+    if 'sn' in sp:
+        recs['sn'][i] = sp['sn']
+    recs['file'][i] = fileIdx
+
+
+def parseBuffer(data, fileIdx=0):
+    return parseLines(data.decode('utf-8').splitlines(), fileIdx)
+
+
+def parseLogBuffer(path, data, fileIdx=0, checked=True):
+    # When checked, only the records in the integrity index of the file are
+    # parsed (built on first read, see logIntegrity), so half-written lines
+    # and zero-filled tails from a power loss are skipped and reported
+    # instead of aborting the run
+    if not checked:
+        return parseBuffer(data, fileIdx)
+    from logIntegrity import checkedRecords
+    return parseRecords(checkedRecords(path, data), fileIdx)
+
+
+def parseRecords(items, fileIdx=0):
+    # Column arrays from already decoded records
+    recs = emptyRecords(len(items))
+    for i, data in enumerate(items):
+        fillRecord(recs, i, data, fileIdx)
+    return recs
+
+
+def parseLines(lines, fileIdx=0):
+    return parseRecords([js.loads(l) for l in lines if l.strip()], fileIdx)
+
+
+def concatRecords(parts):
+    if len(parts) == 0:
+        return emptyRecords(0)
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def selectRecords(recs, idx):
+    return {k: v[idx] for k, v in recs.items()}
+
+
+def zoneOffsets(seconds, tz, local=False):
+    # UTC offset in seconds of zone tz for every element. seconds are UTC
+    # epoch seconds, or wall clock seconds in tz when local is True (the
+    # earlier of two readings is taken in the repeated DST hour). Offsets
+    # are looked up once per quarter hour present, not per record.
+    seconds = np.asarray(seconds, np.int64)
+    if tz in (None, 'UTC'):
+        return np.zeros(seconds.shape, np.int64)
+    zone = ZoneInfo(tz)
+    q, inv = np.unique(seconds // 900, return_inverse=True)
+    off = np.empty(len(q), np.int64)
+    for i, v in enumerate(q.tolist()):
+        if local:
+            d = datetime(1970, 1, 1) + timedelta(seconds=v * 900)
+            off[i] = int(d.replace(tzinfo=zone).utcoffset().total_seconds())
+        else:
+            off[i] = int(datetime.fromtimestamp(v * 900, zone).utcoffset().total_seconds())
+    return off[inv.reshape(seconds.shape)]
+
+
+def recordEpoch(recs, tz='UTC'):
+    # Seconds since 1970 UTC from the nested timestamp fields, year is 2000
+    # based. The logger stamps records with GPS time, which is UTC; tz names
+    # the zone of the clock for logs written with local time.
+    months = (np.asarray(recs['year'], np.int64) + 2000 - 1970) * 12 + recs['month'] - 1
+    d = months.astype('datetime64[M]').astype('datetime64[D]') + (recs['day'] - 1).astype('timedelta64[D]')
+    wall = (d.astype(np.int64) * 86400 + recs['hour'].astype(np.int64) * 3600
+            + recs['minute'].astype(np.int64) * 60 + recs['seconds'])
+    return wall - zoneOffsets(wall, tz, local=True)
+
+
+def localClock(epoch, tz):
+    # Wall clock seconds in tz for UTC epoch seconds, for display (the map
+    # script used hour + 3 for Bucharest summer time)
+    epoch = np.asarray(epoch, np.int64)
+    return epoch + zoneOffsets(epoch, tz)
+
+
+def logFilesOf(dirs, rootDir='./', verbose=False):
+    for dir in dirs:
+        dir = join(rootDir, dir)
+        if verbose:
+            print("reading directory " + dir)
+        for f in listLogFiles(dir):
+            yield f
+
+
+def readRecordChunks(dirs, rootDir='./', workers=4, checked=True):
+    # One chunk of records per log file, in directory then file order, for
+    # stages that stream instead of holding a whole survey
+    for f, data in prefetchFiles(logFilesOf(dirs, rootDir), workers):
+        yield parseLogBuffer(f, data, 0, checked)
+
+
+def readRecords(dirs, rootDir='./', workers=4, checked=True):
+    # Reads every file of every G-directory into one set of column arrays,
+    # one row per log line, in directory then file order. recs['file'] indexes
+    # into the returned list of file paths.
+    parts = []
+    files = []
+    for f, data in prefetchFiles(logFilesOf(dirs, rootDir, verbose=True), workers):
+        parts += [parseLogBuffer(f, data, len(files), checked)]
+        files += [f]
+    return concatRecords(parts), files
@@ -0,0 +1,167 @@
+import json as js
+import mmap
+import os
+import sys
+import numpy as np
+
+from logArrays import SPECTRUM_LEN, listLogFiles
+
+# Integrity scan for logs cut by power loss: half-written last lines,
+# records run together after a restart and zero-filled tails. Every file
+# gets an index of the byte spans of its good records, saved beside it as
+# .idx.npy, so the records can be read back without touching damaged data.
+# logArrays.readRecords and readRecordChunks read through this index, as
+# does the hotspot detector.
+
+requiredFields = {
+    'timestamp': ('year', 'month', 'day', 'hour', 'minute', 'seconds'),
+    'location': ('lat', 'lon', 'fix'),
+    'spectrum': ('time', 'counts', 'temperature', 'hist'),
+}
+
+recordStart = b'{"timestamp"'
+decoder = js.JSONDecoder()
+
+
+def indexPath(logPath):
+    return logPath + '.idx.npy'
+
+
+def validRecord(data):
+    if not isinstance(data, dict):
+        return False
+    for block, keys in requiredFields.items():
+        b = data.get(block)
+        if not isinstance(b, dict) or any(k not in b for k in keys):
+            return False
+    hist = data['spectrum']['hist']
+    return isinstance(hist, list) and len(hist) == SPECTRUM_LEN
+
+
+def parseSpan(buf, start, end):
+    # The decoded record, None if it does not parse or lacks fields
+    try:
+        data = js.loads(bytes(buf[start:end]))
+    except ValueError:
+        return None
+    return data if validRecord(data) else None
+
+
+def salvageSpan(buf, start, end):
+    # Records that start inside a damaged line, each decoded up to where
+    # its JSON ends. Returns [(offset, length)] and the decoded records.
+    line = bytes(buf[start:end])
+    out, decoded = [], []
+    pos = line.find(recordStart)
+    while pos >= 0:
+        try:
+            text = line[pos:].split(b'\0', 1)[0].decode('utf-8')
+            data, n = decoder.raw_decode(text)
+            if validRecord(data):
+                out.append((start + pos, len(text[:n].encode('utf-8'))))
+                decoded.append(data)
+        except ValueError:
+            pass
+        pos = line.find(recordStart, pos + 1)
+    return out, decoded
+
+
+def scanBuffer(data, path=''):
+    # Returns (spans, report), spans is an (n, 2) int64 array of offset and
+    # length of every good record in file order. data is the file content,
+    # bytes or a memory map. report['decoded'] holds the records as decoded
+    # by the scan, so a reader need not parse them again.
+    size = len(data)
+    report = {'path': path, 'lines': 0, 'valid': 0, 'salvaged': 0, 'damaged': [], 'zeroTail': 0,
+              'decoded': []}
+    if size == 0:
+        return np.zeros((0, 2), np.int64), report
+    buf = np.frombuffer(data, np.uint8)
+    nonZero = np.flatnonzero(buf)
+    end = int(nonZero[-1]) + 1 if len(nonZero) else 0
+    report['zeroTail'] = size - end
+    nl = np.flatnonzero(buf[:end] == 10)
+    starts = np.concatenate([[0], nl + 1])
+    stops = np.concatenate([nl, [end]])
+    # strip \r and drop blank lines
+    stops = stops - ((stops > starts) & (buf[np.maximum(stops - 1, 0)] == 13))
+    keep = stops > starts
+    starts, stops = starts[keep], stops[keep]
+    # framing: braces at both ends and no NUL bytes inside
+    nul = np.concatenate([[0], np.cumsum(buf[:end] == 0)])
+    framed = ((buf[starts] == ord('{')) & (buf[stops - 1] == ord('}'))
+              & (nul[stops] == nul[starts]))
+    del buf
+    spans = []
+    decoded = report['decoded']
+    for s, e, ok in zip(starts.tolist(), stops.tolist(), framed.tolist()):
+        rec = parseSpan(data, s, e) if ok else None
+        if rec is not None:
+            spans.append((s, e - s))
+            decoded.append(rec)
+            report['valid'] += 1
+            continue
+        found, recs = salvageSpan(data, s, e)
+        spans += found
+        decoded += recs
+        report['salvaged'] += len(found)
+        if not found:
+            report['damaged'].append(s)
+    report['lines'] = len(starts)
+    return np.array(spans, np.int64).reshape(-1, 2), report
+
+
+def scanFile(path):
+    if os.path.getsize(path) == 0:
+        return scanBuffer(b'', path)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return scanBuffer(mm, path)
+
+
+def loadIndex(logPath, rebuild=False, data=None):
+    # Index of a log file, rescanned when the log is newer than it. data is
+    # the file content when the caller has already read it. Returns (spans,
+    # report), report is None when the cached index is used.
+    path = indexPath(logPath)
+    if not rebuild and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(logPath):
+        return np.load(path), None
+    spans, report = scanFile(logPath) if data is None else scanBuffer(data, logPath)
+    try:
+        np.save(path, spans)
+    except OSError:
+        # read-only card, scanned again next time
+        pass
+    return spans, report
+
+
+def checkedRecords(path, data):
+    # Decoded records of a log file read through its index, damage reported
+    spans, report = loadIndex(path, data=data)
+    if report is None:
+        return [js.loads(bytes(data[s:s + n])) for s, n in spans.tolist()]
+    if isDamaged(report):
+        printReport(report)
+    # freshly scanned, every record was decoded once already
+    return report['decoded']
+
+
+def isDamaged(report):
+    return bool(report['salvaged'] or report['damaged'] or report['zeroTail'])
+
+
+def printReport(report):
+    msg = '{0}: {1} lines, {2} valid, {3} salvaged, {4} damaged'.format(
+        report['path'], report['lines'], report['valid'], report['salvaged'], len(report['damaged']))
+    if report['zeroTail']:
+        msg += ', ' + str(report['zeroTail']) + ' zero bytes at the end'
+    if report['damaged']:
+        msg += ', damaged at byte ' + ', '.join(str(o) for o in report['damaged'][:10])
+    print(msg)
+
+
+if __name__ == '__main__':
+    dirs = sys.argv[1:] if len(sys.argv) > 1 else ['G0000000']
+    for dir in dirs:
+        for f in listLogFiles(dir):
+            spans, report = loadIndex(f, rebuild=True)
+            printReport(report)
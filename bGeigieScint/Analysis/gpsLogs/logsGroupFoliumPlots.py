@@ -36,7 +36,7 @@ uSvMax = 0
 
 for dir in dirs:
     dir = rootDir + dir
-    files = [f for f in listdir(dir) if isfile(join(dir, f))]
+    files = [f for f in listdir(dir) if isfile(join(dir, f)) and f.lower().endswith('.csv')]
     print("reading directory " + dir)
     for f in files:
         with open(join(dir, f)) as currentFile:
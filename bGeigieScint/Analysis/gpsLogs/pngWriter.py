@@ -0,0 +1,31 @@
+import struct
+import zlib
+import numpy as np
+
+# Minimal PNG encoder for 8-bit grey, RGB or RGBA NumPy images, so rasters
+# can be written without a plotting or imaging library.
+
+colorTypes = {1: 0, 3: 2, 4: 6}
+
+
+def pngChunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def encodePng(img, level=6):
+    img = np.ascontiguousarray(img, dtype=np.uint8)
+    if img.ndim == 2:
+        img = img[:, :, None]
+    h, w, c = img.shape
+    # filter type 0 (none) in front of every row
+    raw = np.zeros((h, w * c + 1), np.uint8)
+    raw[:, 1:] = img.reshape(h, w * c)
+    return (b'\x89PNG\r\n\x1a\n'
+            + pngChunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, colorTypes[c], 0, 0, 0))
+            + pngChunk(b'IDAT', zlib.compress(raw.tobytes(), level))
+            + pngChunk(b'IEND', b''))
+
+
+def writePng(path, img, level=6):
+    with open(path, 'wb') as f:
+        f.write(encodePng(img, level))
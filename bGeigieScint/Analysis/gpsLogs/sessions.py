@@ -0,0 +1,97 @@
+import numpy as np
+
+from logArrays import readRecords, recordEpoch, selectRecords
+from trackClean import toLocalMetres
+import cellGrid as cg
+
+# Splits the time-ordered record stream of a G-directory into sessions
+# (drives) and summarises each one, so a single drive can be mapped from
+# the arrays already in memory.
+
+
+def segmentSessions(recs, maxGap=60, maxJump=500.0, maxSpeed=70.0):
+    # Returns (order, label): order sorts recs by time, label[i] is the
+    # session of recs[order[i]], -1 for records without a fix. A new
+    # session starts after a time gap, a position jump that is too far or
+    # too fast, a lost fix, or an acquisition reset (a record integrating
+    # over more time than has passed since the previous one, as after a
+    # power cycle).
+    t = recordEpoch(recs)
+    order = np.argsort(t, kind='stable')
+    t = t[order]
+    fix = recs['fix'][order] == 1
+    live = recs['time'][order]
+    lat, lon = recs['lat'][order], recs['lon'][order]
+    n = len(t)
+    if n == 0:
+        return order, np.zeros(0, np.int64)
+
+    lat0, lon0 = (lat[fix].mean(), lon[fix].mean()) if fix.any() else (0.0, 0.0)
+    x, y = toLocalMetres(lat, lon, lat0, lon0)
+    dt = np.diff(t)
+    d = np.hypot(np.diff(x), np.diff(y))
+    both = fix[1:] & fix[:-1]
+    brk = np.zeros(n, dtype=bool)
+    brk[0] = True
+    brk[1:] = ((dt > maxGap)
+               | (both & (d > maxJump))
+               | (both & (d > maxSpeed * np.maximum(dt, 1)))
+               | (fix[1:] & ~fix[:-1])
+               | (live[1:] > np.maximum(dt, 1) + 1))
+    # only fixed records belong to a session, breaks are counted among them
+    label = np.cumsum(brk[fix]) - 1
+    out = np.full(n, -1, np.int64)
+    out[fix] = label
+    return order, out
+
+
+def sessionStats(recs, order, label):
+    # Per session arrays, indexed by session id
+    keep = label >= 0
+    idx = order[keep]
+    lab = label[keep]
+    nS = int(lab.max()) + 1 if len(lab) else 0
+    if nS == 0:
+        return {'nRecords': np.zeros(0, np.int64)}
+    t = recordEpoch(recs)[idx]
+    live = cg.liveTime(recs)[idx].astype(np.float64)
+    uSv = cg.doseRate(recs['hist'][idx], live)
+    temp = recs['temperature'][idx]
+    lat, lon = recs['lat'][idx], recs['lon'][idx]
+    x, y = toLocalMetres(lat, lon, lat.mean(), lon.mean())
+    step = np.concatenate([[0.0], np.hypot(np.diff(x), np.diff(y))])
+    first = np.concatenate([[True], lab[1:] != lab[:-1]])
+    step[first] = 0.0
+    starts = np.nonzero(first)[0]
+
+    nRec = np.bincount(lab, minlength=nS)
+    return {
+        'nRecords': nRec,
+        'start': t[starts],
+        'end': np.maximum.reduceat(t, starts),
+        'duration': np.maximum.reduceat(t, starts) - t[starts] + 1,
+        'liveTime': np.bincount(lab, weights=live, minlength=nS),
+        'distance': np.bincount(lab, weights=step, minlength=nS),
+        'meanUSv': np.bincount(lab, weights=uSv * live, minlength=nS) / np.bincount(lab, weights=live, minlength=nS),
+        'maxUSv': np.maximum.reduceat(uSv, starts),
+        'minTemperature': np.minimum.reduceat(temp, starts),
+        'maxTemperature': np.maximum.reduceat(temp, starts),
+        'minLat': np.minimum.reduceat(lat, starts),
+        'maxLat': np.maximum.reduceat(lat, starts),
+        'minLon': np.minimum.reduceat(lon, starts),
+        'maxLon': np.maximum.reduceat(lon, starts),
+    }
+
+
+def selectSession(recs, order, label, session):
+    return selectRecords(recs, order[label == session])
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    order, label = segmentSessions(recs)
+    stats = sessionStats(recs, order, label)
+    for s in range(len(stats['nRecords'])):
+        print('session {0}: {1} records, {2} s, {3:.0f} m, mean {4:.3f} / max {5:.3f} uSv/h, {6:.1f}..{7:.1f} C'.format(
+            s, stats['nRecords'][s], stats['duration'][s], stats['distance'][s], stats['meanUSv'][s],
+            stats['maxUSv'][s], stats['minTemperature'][s], stats['maxTemperature'][s]))
@@ -0,0 +1,77 @@
+import re
+import struct
+import xml.etree.ElementTree as ET
+import numpy as np
+
+# Readers for reference spectra such as the ones in Misc Docs/spectrum_files.
+# Both return counts, live time in seconds and the keV edges of the channels.
+
+
+def readPcf(path, index=0):
+    # GADRAS PCF. A 256 byte file header, an optional deviation pair block,
+    # then per spectrum one 256 byte header and float32 channel data.
+    with open(path, 'rb') as f:
+        data = f.read()
+    nrps = struct.unpack('<h', data[0:2])[0]
+    if data[256:276] == b'DeviationPairsInFile' and data[276:286] != b'Compressed':
+        start = 82 * 256
+    elif data[256:276] == b'DeviationPairsInFile':
+        raise ValueError(path + ': compressed deviation pairs are not supported')
+    else:
+        start = 256
+    # empty slots (zero channel count) are skipped when counting index
+    offsets = [o for o in range(start, len(data) - nrps * 256 + 1, nrps * 256)
+               if struct.unpack('<i', data[o + 252:o + 256])[0] > 0]
+    if index >= len(offsets):
+        raise IndexError(path + ': no spectrum ' + str(index))
+    h = data[offsets[index]:offsets[index] + 256]
+    live = struct.unpack('<f', h[204:208])[0]
+    cal = struct.unpack('<5f', h[224:244])
+    n = struct.unpack('<i', h[252:256])[0]
+    counts = np.frombuffer(data, '<f4', n, offsets[index] + 256).astype(np.float64)
+    # full range fraction calibration, x is the channel over the channel count
+    x = np.arange(n + 1) / n
+    edges = cal[0] + cal[1] * x + cal[2] * x * x + cal[3] * x ** 3 + cal[4] / (1.0 + 60.0 * x)
+    return counts, live, edges
+
+
+def isoSeconds(v):
+    m = re.match(r'PT([0-9.]+)S', v.strip())
+    return float(m.group(1)) if m else 0.0
+
+
+def readN42(path, index=0):
+    # ANSI N42.42-2011, the index-th Spectrum element with channel data.
+    # InterSpec writes DHS: elements without declaring the prefix.
+    with open(path, encoding='utf-8') as f:
+        text = re.sub(r'<(/?)DHS:', r'<\1DHS_', f.read())
+    root = ET.fromstring(text.encode('utf-8'))
+
+    def local(e):
+        return e.tag.split('}')[-1]
+
+    cals = {}
+    for e in root.iter():
+        if local(e) == 'EnergyCalibration':
+            for c in e:
+                if local(c) == 'CoefficientValues':
+                    cals[e.get('id')] = [float(v) for v in c.text.split()]
+    spectra = [e for e in root.iter() if local(e) == 'Spectrum'
+               and any(local(c) == 'ChannelData' for c in e)]
+    s = spectra[index]
+    counts = live = None
+    for c in s:
+        if local(c) == 'ChannelData':
+            counts = np.array(c.text.split(), dtype=np.float64)
+        elif local(c) == 'LiveTimeDuration':
+            live = isoSeconds(c.text)
+    coef = cals.get(s.get('energyCalibrationReference'), [0.0, 1.0])
+    i = np.arange(len(counts) + 1, dtype=np.float64)
+    edges = sum(c * i ** k for k, c in enumerate(coef))
+    return counts, live, edges
+
+
+def readSpectrumFile(path, index=0):
+    if path.lower().endswith('.pcf'):
+        return readPcf(path, index)
+    return readN42(path, index)
@@ -0,0 +1,116 @@
+import sys
+import numpy as np
+
+from logArrays import defaultEcal, readRecords, selectRecords
+from backgroundSubtract import roisDefault
+from cellStatistics import cellUncertainty
+from energyWindows import windowCountsKeV
+import cellGrid as cg
+
+# Change between two surveys of the same area on the same grid. Cell
+# aggregates are sorted by key, so aligning them is a merge of two sorted
+# int64 arrays; every difference comes with its Poisson significance.
+
+
+def alignKeys(keysA, keysB):
+    # Union of two sorted key arrays, with the row of each key in A and in
+    # B (-1 where the survey has no such cell). The stable sort of the two
+    # concatenated sorted runs is a linear merge (timsort finds the runs).
+    keysA = np.asarray(keysA, np.int64)
+    keysB = np.asarray(keysB, np.int64)
+    cat = np.concatenate([keysA, keysB])
+    order = np.argsort(cat, kind='stable')
+    merged = cat[order]
+    first = np.ones(len(merged), dtype=bool)
+    first[1:] = merged[1:] != merged[:-1]
+    group = np.cumsum(first) - 1
+    keys = merged[first]
+    ia = np.full(len(keys), -1, np.int64)
+    ib = np.full(len(keys), -1, np.int64)
+    fromA = order < len(keysA)
+    ia[group[fromA]] = order[fromA]
+    ib[group[~fromA]] = order[~fromA] - len(keysA)
+    return keys, ia, ib
+
+
+def cellRates(cells, rois=roisDefault, ecal=defaultEcal):
+    # Dose rate and ROI count rates with their Poisson standard errors
+    t = np.asarray(cells['time'], dtype=np.float64)
+    stats = cellUncertainty(cells, cg.channelKeV(ecal, cells['hist'].shape[1]))
+    rates = {'uSv': stats['uSv'], 'uSvErr': stats['uSvErr']}
+    for name, (lo, hi) in rois.items():
+        c = windowCountsKeV(cells, lo, hi, ecal).astype(np.float64)
+        rates[name] = c / t
+        rates[name + 'Err'] = np.sqrt(c) / t
+    return rates
+
+
+def alignedValues(values, idx):
+    # values[idx] with NaN where idx is -1, also when values is empty
+    out = np.full(len(idx), np.nan)
+    have = idx >= 0
+    out[have] = values[idx[have]]
+    return out
+
+
+def compareSurveys(cellsA, cellsB, rois=roisDefault, ecal=defaultEcal):
+    # B - A for every cell of either survey. Quantities are NaN where one
+    # survey has no data, inA/inB tell which. For each of 'uSv' and the ROI
+    # names there is the difference, its error and its significance
+    # (difference over the combined error).
+    keys, ia, ib = alignKeys(cellsA['key'], cellsB['key'])
+    ra, rb = cellRates(cellsA, rois, ecal), cellRates(cellsB, rois, ecal)
+    out = {'key': keys, 'inA': ia >= 0, 'inB': ib >= 0, 'names': ['uSv'] + list(rois)}
+    both = (ia >= 0) & (ib >= 0)
+    for name in out['names']:
+        a = alignedValues(ra[name], ia)
+        b = alignedValues(rb[name], ib)
+        err = np.hypot(alignedValues(ra[name + 'Err'], ia), alignedValues(rb[name + 'Err'], ib))
+        diff = b - a
+        out[name + 'A'] = a
+        out[name + 'B'] = b
+        out[name] = diff
+        out[name + 'Err'] = err
+        out[name + 'Sig'] = np.where(both & (err > 0), diff / np.where(err > 0, err, 1.0), np.where(both, 0.0, np.nan))
+    return out
+
+
+def addDiffLayer(m, diff, grid, name='uSv', minSig=2.0, maxSig=5.0):
+    # Cells present in both surveys whose change is at least minSig sigma,
+    # red for an increase and blue for a decrease, opacity by significance
+    import folium
+    sig = diff[name + 'Sig']
+    sel = np.nonzero(np.abs(np.nan_to_num(sig)) >= minSig)[0]
+    lat, lon = cg.cellCorner(diff['key'][sel], grid)
+    layer = folium.FeatureGroup(name=name + ' change')
+    for j, i in enumerate(sel):
+        folium.Rectangle(
+            bounds=[[lat[j], lon[j]], [lat[j] + grid[0], lon[j] + grid[1]]],
+            color="black",
+            weight=0.5,
+            opacity=1,
+            fill=True,
+            fill_color="red" if sig[i] > 0 else "blue",
+            fill_opacity=float(min(abs(sig[i]) / maxSig, 1.0)),
+            tooltip="{0}: {1:+.3f} +- {2:.3f} ({3:+.1f} sigma)".format(
+                name, diff[name][i], diff[name + 'Err'][i], sig[i]),
+        ).add_to(layer)
+    layer.add_to(m)
+
+
+if __name__ == '__main__':
+    grid = cg.gridSpacing()
+    if len(sys.argv) > 2:
+        cellsA = cg.mapCells(readRecords([sys.argv[1]])[0], grid)
+        cellsB = cg.mapCells(readRecords([sys.argv[2]])[0], grid)
+    else:
+        # the first log file against the rest of the sample survey
+        recs, files = readRecords(['G0000000'])
+        cellsA = cg.mapCells(selectRecords(recs, recs['file'] == 0), grid)
+        cellsB = cg.mapCells(selectRecords(recs, recs['file'] != 0), grid)
+    diff = compareSurveys(cellsA, cellsB)
+    both = diff['inA'] & diff['inB']
+    print(str(both.sum()) + ' shared cells, ' + str((diff['inA'] & ~diff['inB']).sum()) + ' only in A, '
+          + str((diff['inB'] & ~diff['inA']).sum()) + ' only in B')
+    for name in diff['names']:
+        print(name + ' sigma: ' + str(np.round(diff[name + 'Sig'][both], 2)))
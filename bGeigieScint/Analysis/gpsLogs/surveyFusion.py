@@ -0,0 +1,109 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from os.path import basename, normpath
+
+from logArrays import readRecords, selectRecords
+from energyRebin import kevEdgesDefault, rebinSpectra
+import cellGrid as cg
+
+# Multi-detector fusion. Every device keeps its own cell aggregate on the
+# common keV grid, so one unit can be dropped from the fused map without
+# reading the logs again.
+
+
+def readDirectory(dir, rootDir='./'):
+    recs, files = readRecords([dir], rootDir)
+    # Logs written without a serial number are keyed by their G-directory
+    recs['sn'][recs['sn'] == ''] = basename(normpath(dir))
+    return recs
+
+
+def deviceContributions(recs, grid, kevEdges=kevEdgesDefault):
+    # Per device, rebin with the device's own calibration, then sum spectra
+    # and live time per cell.
+    contribs = {}
+    m = cg.mapRecordMask(recs)
+    for sn in np.unique(recs['sn'][m]):
+        r = selectRecords(recs, np.nonzero(m & (recs['sn'] == sn))[0])
+        cells = cg.aggregateCells(cg.recordKeys(r, grid), rebinSpectra(r['hist'], r['ecal'], kevEdges),
+                                  cg.liveTime(r))
+        cells['ecal'] = np.unique(r['ecal'], axis=0)
+        contribs[str(sn)] = cells
+    return contribs
+
+
+def directoryContributions(dir, grid, rootDir='./', kevEdges=kevEdgesDefault):
+    return deviceContributions(readDirectory(dir, rootDir), grid, kevEdges)
+
+
+def ingestDevices(dirs, grid, rootDir='./', kevEdges=kevEdgesDefault, workers=None):
+    # One worker per G-directory reads, rebins and aggregates it, so only the
+    # per-device cell aggregates come back to this process. Contributions
+    # from directories that share a serial number are merged afterwards.
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(directoryContributions, d, grid, rootDir, kevEdges) for d in dirs]
+        parts = [f.result() for f in futures]
+    contribs = {}
+    for part in parts:
+        for sn, cells in part.items():
+            if sn in contribs:
+                ecal = np.unique(np.concatenate([contribs[sn]['ecal'], cells['ecal']]), axis=0)
+                contribs[sn] = cg.mergeCells([contribs[sn], cells])
+                contribs[sn]['ecal'] = ecal
+            else:
+                contribs[sn] = cells
+    return contribs
+
+
+def estimateEfficiency(contribs, minDevices=2):
+    # Relative efficiency per device, the median over shared cells of the
+    # device's gross count rate divided by the mean rate of all devices in
+    # that cell. Devices with no shared cells keep 1.
+    keys = np.concatenate([c['key'] for c in contribs.values()])
+    ukeys, nDev = np.unique(keys, return_counts=True)
+    shared = ukeys[nDev >= minDevices]
+    if len(shared) == 0:
+        return {sn: 1.0 for sn in contribs}
+
+    rates = {}
+    for sn, c in contribs.items():
+        r = np.full(len(shared), np.nan)
+        pos = np.searchsorted(c['key'], shared)
+        pos = np.minimum(pos, len(c['key']) - 1)
+        hit = c['key'][pos] == shared
+        r[hit] = c['hist'][pos[hit]].sum(axis=1) / c['time'][pos[hit]]
+        rates[sn] = r
+    fleet = np.nanmean(np.stack(list(rates.values())), axis=0)
+
+    eff = {}
+    for sn, r in rates.items():
+        ok = np.isfinite(r) & (fleet > 0)
+        eff[sn] = float(np.median(r[ok] / fleet[ok])) if ok.any() else 1.0
+        if eff[sn] <= 0:
+            eff[sn] = 1.0
+    return eff
+
+
+def fuseCells(contribs, efficiency=None, exclude=()):
+    # Fused cell grid, spectra divided by each device's relative efficiency
+    parts = []
+    for sn, c in contribs.items():
+        if sn in exclude:
+            continue
+        eff = 1.0 if efficiency is None else efficiency.get(sn, 1.0)
+        parts += [{'key': c['key'], 'hist': c['hist'] / eff, 'time': c['time'], 'nRecords': c['nRecords']}]
+    return cg.mergeCells(parts)
+
+
+if __name__ == '__main__':
+    dirs = ['G0000000']
+    grid = cg.gridSpacing()
+    contribs = ingestDevices(dirs, grid)
+    eff = estimateEfficiency(contribs)
+    fused = fuseCells(contribs, eff)
+    kevCentres = 0.5 * (kevEdgesDefault[:-1] + kevEdgesDefault[1:])
+    uSv = cg.doseRate(fused['hist'], fused['time'], kevCentres)
+    for sn in contribs:
+        print(sn + ': ' + str(len(contribs[sn]['key'])) + ' cells, efficiency ' + str(eff[sn]))
+    print('fused cells = ' + str(len(fused['key'])))
+    print('max dose rate = ' + str(uSv.max()))
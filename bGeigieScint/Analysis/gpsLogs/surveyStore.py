@@ -0,0 +1,169 @@
+import sqlite3
+import sys
+import zlib
+import numpy as np
+
+from os.path import basename
+
+from logArrays import SPECTRUM_LEN, emptyRecords, logFilesOf, parseLogBuffer, prefetchFiles, recordEpoch
+
+# Local SQLite store of all surveys. WAL mode so several tools can read while
+# one ingests, records bulk loaded with executemany per log file, spectra as
+# zlib compressed int32 BLOBs, an R*Tree over position and an index on time.
+# survey_files records every log file loaded, in the same transaction as its
+# records, so an interrupted ingest resumes with the next file.
+
+schema = '''
+CREATE TABLE IF NOT EXISTS surveys (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    survey INTEGER NOT NULL REFERENCES surveys(id),
+    t INTEGER NOT NULL,
+    lat REAL, lon REAL, alt REAL, speed REAL, angle REAL, hdop REAL,
+    fix INTEGER, fixQ INTEGER, nSat INTEGER,
+    live INTEGER, counts INTEGER, temperature REAL,
+    sn TEXT, ecal0 REAL, ecal1 REAL, ecal2 REAL,
+    hist BLOB
+);
+CREATE TABLE IF NOT EXISTS survey_files (
+    survey INTEGER NOT NULL REFERENCES surveys(id),
+    name TEXT NOT NULL,
+    records INTEGER NOT NULL,
+    PRIMARY KEY (survey, name)
+);
+CREATE INDEX IF NOT EXISTS records_t ON records(t);
+CREATE INDEX IF NOT EXISTS records_survey ON records(survey, t);
+CREATE VIRTUAL TABLE IF NOT EXISTS records_pos USING rtree(id, minLat, maxLat, minLon, maxLon);
+'''
+
+insertRecord = ('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+insertPos = 'INSERT INTO records_pos VALUES (?, ?, ?, ?, ?)'
+selectColumns = ('r.t, r.lat, r.lon, r.alt, r.speed, r.angle, r.hdop, r.fix, r.fixQ, r.nSat, '
+                 'r.live, r.counts, r.temperature, r.sn, r.ecal0, r.ecal1, r.ecal2, r.hist')
+
+
+def openStore(path):
+    con = sqlite3.connect(path, timeout=30.0)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.executescript(schema)
+    return con
+
+
+def surveyId(con, name):
+    with con:
+        con.execute('INSERT OR IGNORE INTO surveys(name) VALUES (?)', (name,))
+    return con.execute('SELECT id FROM surveys WHERE name = ?', (name,)).fetchone()[0]
+
+
+def compressHist(hist, level=1):
+    h = np.ascontiguousarray(hist, dtype='<i4')
+    return [zlib.compress(row, level) for row in h]
+
+
+def insertRecords(con, survey, recs, fileName=None):
+    # One transaction, ids assigned here so the R*Tree rows share them. It is
+    # started IMMEDIATE so the write lock is held before MAX(id) is read and
+    # two ingesting tools cannot take the same ids. fileName, if given, is
+    # marked as loaded in the same transaction.
+    n = len(recs['time'])
+    if n == 0 and fileName is None:
+        return 0
+    with con:
+        con.execute('BEGIN IMMEDIATE')
+        if fileName is not None:
+            con.execute('INSERT INTO survey_files VALUES (?, ?, ?)', (survey, fileName, n))
+        if n == 0:
+            return 0
+        first = con.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM records').fetchone()[0]
+        ids = np.arange(first, first + n)
+        cols = [ids.tolist(), [survey] * n, recordEpoch(recs).tolist()]
+        cols += [recs[k].tolist() for k in ('lat', 'lon', 'alt', 'speed', 'angle', 'hdop', 'fix', 'fixQ', 'nSat',
+                                            'time', 'counts', 'temperature', 'sn')]
+        cols += [recs['ecal'][:, i].tolist() for i in range(3)]
+        cols += [compressHist(recs['hist'])]
+        con.executemany(insertRecord, zip(*cols))
+        fixed = recs['fix'] == 1
+        lat, lon = recs['lat'][fixed].tolist(), recs['lon'][fixed].tolist()
+        con.executemany(insertPos, zip(ids[fixed].tolist(), lat, lat, lon, lon))
+    return n
+
+
+def ingestSurvey(con, dir, rootDir='./', name=None):
+    # Loads the log files of a survey that are not in the store yet, so a
+    # survey is completed when ingested again after an interruption
+    survey = surveyId(con, dir if name is None else name)
+    done = {r[0] for r in con.execute('SELECT name FROM survey_files WHERE survey = ?', (survey,))}
+    if not done and con.execute('SELECT 1 FROM records WHERE survey = ? LIMIT 1', (survey,)).fetchone():
+        # loaded by a version without survey_files, treated as complete
+        return 0
+    todo = [f for f in logFilesOf([dir], rootDir) if basename(f) not in done]
+    n = 0
+    for f, data in prefetchFiles(todo):
+        n += insertRecords(con, survey, parseLogBuffer(f, data), basename(f))
+    return n
+
+
+def incompleteSurveys(con, rootDir='./'):
+    # Surveys whose directory has log files that are not in the store
+    out = []
+    for survey, name in con.execute('SELECT id, name FROM surveys').fetchall():
+        done = {r[0] for r in con.execute('SELECT name FROM survey_files WHERE survey = ?', (survey,))}
+        try:
+            files = {basename(f) for f in logFilesOf([name], rootDir)}
+        except OSError:
+            continue
+        if done and files - done:
+            out.append(name)
+    return out
+
+
+def rowsToRecords(rows, nChannels=SPECTRUM_LEN):
+    # Back to logArrays column arrays, the timestamp as epoch seconds in 't'
+    recs = emptyRecords(len(rows))
+    recs['t'] = np.zeros(len(rows), np.int64)
+    if len(rows) == 0:
+        return recs
+    cols = list(zip(*rows))
+    for i, k in enumerate(('t', 'lat', 'lon', 'alt', 'speed', 'angle', 'hdop', 'fix', 'fixQ', 'nSat',
+                           'time', 'counts', 'temperature', 'sn')):
+        recs[k][:] = cols[i]
+    recs['ecal'][:] = np.column_stack(cols[14:17])
+    recs['hist'][:] = np.frombuffer(b''.join(zlib.decompress(b) for b in cols[17]), '<i4').reshape(-1, nChannels)
+    return recs
+
+
+def query(con, bbox=None, tStart=None, tEnd=None, survey=None):
+    # bbox = (minLat, minLon, maxLat, maxLon). Position goes through the
+    # R*Tree, time through the t index.
+    sql = 'SELECT ' + selectColumns + ' FROM records r'
+    where, args = [], []
+    if bbox is not None:
+        sql += ' JOIN records_pos p ON p.id = r.id'
+        where += ['p.minLat >= ?', 'p.maxLat <= ?', 'p.minLon >= ?', 'p.maxLon <= ?']
+        args += [bbox[0], bbox[2], bbox[1], bbox[3]]
+    if tStart is not None:
+        where += ['r.t >= ?']
+        args += [int(tStart)]
+    if tEnd is not None:
+        where += ['r.t < ?']
+        args += [int(tEnd)]
+    if survey is not None:
+        where += ['r.survey = (SELECT id FROM surveys WHERE name = ?)']
+        args += [survey]
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY r.t'
+    return rowsToRecords(con.execute(sql, args).fetchall())
+
+
+if __name__ == '__main__':
+    con = openStore('surveys.sqlite')
+    for dir in (sys.argv[1:] if len(sys.argv) > 1 else ['G0000000']):
+        print(dir + ': ' + str(ingestSurvey(con, dir)) + ' records')
+    recs = query(con, bbox=(44.4310, 26.0410, 44.4320, 26.0420))
+    print('records in bbox = ' + str(len(recs['t'])) + ', counts ' + str(recs['hist'].sum()))
+    con.close()
@@ -0,0 +1,69 @@
+import heapq
+import sys
+import numpy as np
+from itertools import repeat
+
+from logArrays import concatRecords, logFilesOf, parseLogBuffer, prefetchFiles, recordEpoch, selectRecords
+
+# One time-sorted record stream from many log files. Each file is sorted on
+# its own (they nearly always are already) and the files are k-way merged
+# on (epoch, serial number), so records from several loggers or from
+# overlapping copies of the same card interleave in O(n log k). Records
+# logged twice are dropped.
+
+
+def sortedChunk(recs, tz='UTC'):
+    t = recordEpoch(recs, tz)
+    if len(t) > 1 and (np.diff(t) < 0).any():
+        order = np.argsort(t, kind='stable')
+        recs, t = selectRecords(recs, order), t[order]
+    return recs, t
+
+
+def mergeOrder(keys):
+    # keys: per chunk a sorted list of merge keys. Returns the chunk and row
+    # of every record in merged order.
+    streams = [zip(k, repeat(i), range(len(k))) for i, k in enumerate(keys)]
+    merged = list(heapq.merge(*streams))
+    chunk = np.fromiter((m[1] for m in merged), np.int64, len(merged))
+    row = np.fromiter((m[2] for m in merged), np.int64, len(merged))
+    return chunk, row
+
+
+def duplicateMask(recs, t):
+    # Neighbours in merged order that repeat the same device, second and
+    # spectrum
+    dup = np.zeros(len(t), dtype=bool)
+    if len(t) > 1:
+        dup[1:] = ((t[1:] == t[:-1]) & (recs['sn'][1:] == recs['sn'][:-1])
+                   & (recs['time'][1:] == recs['time'][:-1]) & (recs['counts'][1:] == recs['counts'][:-1])
+                   & (recs['hist'][1:] == recs['hist'][:-1]).all(axis=1))
+    return dup
+
+
+def readMergedRecords(dirs, rootDir='./', tz='UTC', workers=4, checked=True):
+    # Like readRecords but in time order with duplicates removed. Also
+    # returns the epoch of every record and the number of duplicates.
+    parts, times, files = [], [], []
+    for f, data in prefetchFiles(logFilesOf(dirs, rootDir, verbose=True), workers):
+        recs, t = sortedChunk(parseLogBuffer(f, data, len(files), checked), tz)
+        parts.append(recs)
+        times.append(t)
+        files.append(f)
+    keys = [list(zip(t.tolist(), p['sn'].tolist())) for p, t in zip(parts, times)]
+    chunk, row = mergeOrder(keys)
+    offsets = np.concatenate([[0], np.cumsum([len(t) for t in times])])
+    idx = offsets[chunk] + row
+    recs = selectRecords(concatRecords(parts), idx)
+    t = np.concatenate(times)[idx] if len(idx) else np.zeros(0, np.int64)
+    dup = duplicateMask(recs, t)
+    keep = np.nonzero(~dup)[0]
+    return selectRecords(recs, keep), t[keep], files, int(dup.sum())
+
+
+if __name__ == '__main__':
+    dirs = sys.argv[1:] if len(sys.argv) > 1 else ['G0000000']
+    recs, t, files, nDup = readMergedRecords(dirs, tz='UTC')
+    print(str(len(t)) + ' records from ' + str(len(files)) + ' files, ' + str(nDup) + ' duplicates dropped')
+    print(str(np.datetime64(int(t[0]), 's')) + ' .. ' + str(np.datetime64(int(t[-1]), 's')) + ' UTC, sorted: '
+          + str(bool((np.diff(t) >= 0).all())))
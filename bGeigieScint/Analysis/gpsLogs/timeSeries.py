@@ -0,0 +1,132 @@
+import numpy as np
+
+from logArrays import readRecords, recordEpoch
+import cellGrid as cg
+
+# Dose rate, count rate and temperature versus time. Min/max/mean rollups
+# are built once at ingest at several bucket widths, plots pick the coarsest
+# level that still resolves the view and thin it with LTTB.
+
+rollupLevels = (1, 10, 60, 600, 3600)
+
+
+def recordSeries(recs):
+    # Per record series, in time order
+    t = recordEpoch(recs)
+    order = np.argsort(t, kind='stable')
+    live = cg.liveTime(recs)[order].astype(np.float64)
+    hist = recs['hist'][order]
+    return t[order], {
+        'uSv': cg.doseRate(hist, live),
+        'cps': hist.sum(axis=1) / live,
+        'temperature': recs['temperature'][order],
+    }
+
+
+def buildRollups(t, series, levels=rollupLevels):
+    # level -> {'t': bucket start, name: {'min', 'max', 'mean'}}, t sorted
+    rollups = {}
+    for level in levels:
+        bucket = t // level
+        starts = np.concatenate([[0], np.nonzero(np.diff(bucket))[0] + 1]) if len(t) else np.zeros(0, np.int64)
+        n = np.diff(np.concatenate([starts, [len(t)]]))
+        r = {'t': bucket[starts] * level}
+        for name, v in series.items():
+            r[name] = {
+                'min': np.minimum.reduceat(v, starts) if len(t) else v[:0],
+                'max': np.maximum.reduceat(v, starts) if len(t) else v[:0],
+                'mean': np.add.reduceat(v, starts) / n if len(t) else v[:0],
+            }
+        rollups[level] = r
+    return rollups
+
+
+def saveRollups(path, rollups):
+    flat = {}
+    for level, r in rollups.items():
+        flat['L{}_t'.format(level)] = r['t']
+        for name, v in r.items():
+            if name != 't':
+                for stat, a in v.items():
+                    flat['L{}_{}_{}'.format(level, name, stat)] = a
+    np.savez_compressed(path, **flat)
+
+
+def loadRollups(path):
+    rollups = {}
+    with np.load(path) as f:
+        for k in f.files:
+            parts = k.split('_')
+            r = rollups.setdefault(int(parts[0][1:]), {})
+            if parts[1] == 't':
+                r['t'] = f[k]
+            else:
+                r.setdefault(parts[1], {})[parts[2]] = f[k]
+    return rollups
+
+
+def lttb(x, y, nOut):
+    # Largest-triangle-three-buckets, keeps first and last point and the
+    # point of each bucket forming the largest triangle with its neighbours
+    n = len(x)
+    if nOut >= n or nOut < 3:
+        return np.arange(n)
+    edges = np.floor(np.linspace(1, n - 1, nOut - 1)).astype(np.int64)
+    idx = np.empty(nOut, np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for b in range(nOut - 2):
+        lo, hi = edges[b], edges[b + 1]
+        nLo, nHi = hi, edges[b + 2] if b + 2 < len(edges) else n
+        cx = x[nLo:nHi].mean() if nHi > nLo else x[-1]
+        cy = y[nLo:nHi].mean() if nHi > nLo else y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[b + 1] = a
+    return idx
+
+
+def viewSeries(rollups, name, tStart, tEnd, width=1500):
+    # Coarsest level with at least width buckets in [tStart, tEnd), falling
+    # back to the finest. Returns t, mean, min and max thinned to width points;
+    # LTTB runs on the max so peaks survive.
+    levels = sorted(rollups)
+    level = levels[0]
+    for l in levels:
+        if (tEnd - tStart) / l >= width:
+            level = l
+    r = rollups[level]
+    sel = (r['t'] >= tStart) & (r['t'] < tEnd)
+    t = r['t'][sel]
+    v = {stat: a[sel] for stat, a in r[name].items()}
+    idx = lttb(t.astype(np.float64), v['max'], width)
+    return t[idx], v['mean'][idx], v['min'][idx], v['max'][idx]
+
+
+def plotSurvey(rollups, tStart=None, tEnd=None, width=1500, png='timeSeries.png'):
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    finest = rollups[min(rollups)]['t']
+    tStart = finest[0] if tStart is None else tStart
+    tEnd = finest[-1] + 1 if tEnd is None else tEnd
+
+    fig, axes = plt.subplots(3, 1, sharex=True, figsize=(10, 7))
+    for ax, name, label in zip(axes, ('uSv', 'cps', 'temperature'), ('uSv/h', 'cps', 'deg C')):
+        t, mean, lo, hi = viewSeries(rollups, name, tStart, tEnd, width)
+        dates = t.astype('datetime64[s]')
+        ax.fill_between(dates, lo, hi, alpha=0.3, linewidth=0)
+        ax.plot(dates, mean, linewidth=0.8)
+        ax.set_ylabel(label)
+    axes[-1].xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    fig.savefig(png)
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    t, series = recordSeries(recs)
+    rollups = buildRollups(t, series)
+    for level in rollupLevels:
+        print('level ' + str(level) + ' s: ' + str(len(rollups[level]['t'])) + ' buckets')
+    t, mean, lo, hi = viewSeries(rollups, 'uSv', t[0], t[-1] + 1, width=50)
+    print('view points = ' + str(len(t)) + ', max dose rate = ' + str(hi.max()))
@@ -0,0 +1,177 @@
+import numpy as np
+
+from logArrays import readRecords, recordEpoch, selectRecords
+
+# Trajectory cleaning on whole record arrays: GPS quality masks, duplicate
+# timestamps, speed-impossible jumps, then a constant-velocity Kalman
+# smoother run over all tracks together.
+
+R_EARTH = 6371008.8
+
+
+def toLocalMetres(lat, lon, lat0, lon0):
+    k = np.pi / 180.0 * R_EARTH
+    return (lon - lon0) * k * np.cos(np.radians(lat0)), (lat - lat0) * k
+
+
+def fromLocalMetres(x, y, lat0, lon0):
+    k = np.pi / 180.0 * R_EARTH
+    return lat0 + y / k, lon0 + x / (k * np.cos(np.radians(lat0)))
+
+
+def qualityMask(recs, minSat=4, maxHdop=5.0, minFixQ=1):
+    return ((recs['fix'] == 1) & (recs['fixQ'] >= minFixQ)
+            & (recs['nSat'] >= minSat) & (recs['hdop'] <= maxHdop))
+
+
+def segmentSpeeds(x, y, t):
+    dt = np.diff(t).astype(np.float64)
+    d = np.hypot(np.diff(x), np.diff(y))
+    return np.where(dt > 0, d / np.where(dt > 0, dt, 1.0), np.inf)
+
+
+def jumpMask(x, y, t, maxSpeed=70.0):
+    # A fix is a jump when both the segment into it and out of it are faster
+    # than maxSpeed (m/s). The first and last fix only have one segment; they
+    # are a jump when it is fast while the next segment along is not, i.e.
+    # their neighbour agrees with the rest of the track and they do not.
+    if len(x) < 2:
+        return np.ones(len(x), dtype=bool)
+    v = segmentSpeeds(x, y, t)
+    fast = v > maxSpeed
+    vIn = np.concatenate([[False], fast])
+    vOut = np.concatenate([fast, [False]])
+    if len(x) > 2:
+        vIn[0] = vOut[0] and not fast[1]
+        vOut[-1] = vIn[-1] and not fast[-2]
+    return ~(vIn & vOut)
+
+
+def trackIds(t, maxGap=30):
+    # New track after a time gap of more than maxGap seconds
+    if len(t) == 0:
+        return np.zeros(0, np.int64)
+    return np.concatenate([[0], np.cumsum(np.diff(t) > maxGap)]).astype(np.int64)
+
+
+def kalmanSmooth(x, y, t, track, sigma, accel=1.0):
+    # Constant velocity model per axis, state (position, velocity), with
+    # acceleration noise density accel (m/s^2) and measurement noise sigma (m)
+    # per fix. Tracks are padded to the same length and stepped together, the
+    # padding steps have dt = 0 and no measurement.
+    n = len(x)
+    if n == 0:
+        return x.copy(), y.copy()
+    starts = np.concatenate([[0], np.nonzero(np.diff(track))[0] + 1])
+    lengths = np.diff(np.concatenate([starts, [n]]))
+    nTracks, L = len(starts), lengths.max()
+    row = np.repeat(np.arange(nTracks), lengths)
+    col = np.arange(n) - np.repeat(starts, lengths)
+
+    # batch is (track, axis), flattened to B = 2 * nTracks
+    B = 2 * nTracks
+    z = np.zeros((L, nTracks, 2))
+    z[col, row, 0] = x
+    z[col, row, 1] = y
+    r = np.full((L, nTracks, 2), np.inf)
+    r[col, row, :] = (sigma * sigma)[:, None]
+    dtAll = np.zeros((L, nTracks))
+    tt = np.zeros((L, nTracks))
+    tt[col, row] = t
+    dtAll[1:] = np.diff(tt, axis=0)
+    have = np.zeros((L, nTracks), dtype=bool)
+    have[col, row] = True
+    dtAll[~have] = 0.0
+    z = z.reshape(L, B)
+    r = r.reshape(L, B)
+    dtAll = np.repeat(dtAll, 2, axis=1)
+
+    xf = np.zeros((L, B, 2))
+    Pf = np.zeros((L, B, 2, 2))
+    xp = np.zeros((L, B, 2))
+    Pp = np.zeros((L, B, 2, 2))
+    xs = np.zeros((B, 2))
+    xs[:, 0] = z[0]
+    P = np.zeros((B, 2, 2))
+    P[:, 0, 0] = np.where(np.isfinite(r[0]), r[0], 1e6)
+    P[:, 1, 1] = 100.0
+    q = accel * accel
+    for k in range(L):
+        dt = dtAll[k]
+        if k > 0:
+            # predict
+            xs = np.stack([xs[:, 0] + dt * xs[:, 1], xs[:, 1]], axis=1)
+            F = np.zeros((B, 2, 2))
+            F[:, 0, 0] = 1.0
+            F[:, 0, 1] = dt
+            F[:, 1, 1] = 1.0
+            Q = np.empty((B, 2, 2))
+            Q[:, 0, 0] = q * dt ** 3 / 3
+            Q[:, 0, 1] = Q[:, 1, 0] = q * dt ** 2 / 2
+            Q[:, 1, 1] = q * dt
+            P = F @ P @ F.transpose(0, 2, 1) + Q
+        xp[k] = xs
+        Pp[k] = P
+        # update, position measurement only, skipped where r is inf
+        meas = np.isfinite(r[k])
+        S = P[:, 0, 0] + np.where(meas, r[k], 1.0)
+        K = np.where(meas[:, None], P[:, :, 0] / S[:, None], 0.0)
+        innov = np.where(meas, z[k] - xs[:, 0], 0.0)
+        xs = xs + K * innov[:, None]
+        P = P - K[:, :, None] * P[:, None, 0, :]
+        xf[k] = xs
+        Pf[k] = P
+
+    # Rauch-Tung-Striebel backward pass
+    xsm = xf[L - 1].copy()
+    out = np.zeros((L, B))
+    out[L - 1] = xsm[:, 0]
+    for k in range(L - 2, -1, -1):
+        dt = dtAll[k + 1]
+        F = np.zeros((B, 2, 2))
+        F[:, 0, 0] = 1.0
+        F[:, 0, 1] = dt
+        F[:, 1, 1] = 1.0
+        C = Pf[k] @ F.transpose(0, 2, 1) @ np.linalg.inv(Pp[k + 1])
+        xsm = xf[k] + (C @ (xsm - xp[k + 1])[:, :, None])[:, :, 0]
+        out[k] = xsm[:, 0]
+
+    out = out.reshape(L, nTracks, 2)
+    return out[col, row, 0], out[col, row, 1]
+
+
+def cleanTrack(recs, minSat=4, maxHdop=5.0, maxSpeed=70.0, maxGap=30, uere=5.0, accel=1.0):
+    # Returns the kept records in time order with smoothed lat/lon (the raw
+    # fix is kept as rawLat/rawLon) and the indices into recs they came from.
+    t = recordEpoch(recs)
+    order = np.argsort(t, kind='stable')
+    order = order[qualityMask(selectRecords(recs, order), minSat, maxHdop)]
+    t = t[order]
+    # duplicate timestamps, first record wins
+    keep = np.concatenate([[True], np.diff(t) > 0]) if len(t) else np.zeros(0, bool)
+    order, t = order[keep], t[keep]
+
+    lat, lon = recs['lat'][order], recs['lon'][order]
+    lat0, lon0 = (lat.mean(), lon.mean()) if len(lat) else (0.0, 0.0)
+    x, y = toLocalMetres(lat, lon, lat0, lon0)
+    keep = jumpMask(x, y, t, maxSpeed)
+    order, t, x, y = order[keep], t[keep], x[keep], y[keep]
+
+    track = trackIds(t, maxGap)
+    sigma = np.maximum(recs['hdop'][order], 0.5) * uere
+    xs, ys = kalmanSmooth(x, y, t.astype(np.float64), track, sigma, accel)
+
+    out = selectRecords(recs, order)
+    out['rawLat'], out['rawLon'] = out['lat'], out['lon']
+    out['lat'], out['lon'] = fromLocalMetres(xs, ys, lat0, lon0)
+    out['track'] = track
+    return out, order
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(['G0000000'])
+    clean, idx = cleanTrack(recs, minSat=3, maxHdop=30.0)
+    x, y = toLocalMetres(clean['lat'], clean['lon'], clean['rawLat'], clean['rawLon'])
+    print('records = ' + str(len(recs['lat'])) + ', kept ' + str(len(idx)))
+    print('tracks = ' + str(len(np.unique(clean['track']))))
+    print('mean correction = ' + str(np.hypot(x, y).mean()) + ' m')
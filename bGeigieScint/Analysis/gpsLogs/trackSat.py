@@ -0,0 +1,99 @@
+import os
+import sys
+import numpy as np
+from os.path import join
+
+from logArrays import defaultEcal, logFilesOf
+from energyWindows import keVToChannels
+from timeMerge import readMergedRecords
+
+# Summed-area table over the record x channel matrix of a whole track (a
+# G-directory, its log files merged in time order through the integrity
+# index), so any time range x energy window sum is four lookups. Saved as
+# .npy in the directory and memory mapped when loaded again.
+
+
+def satPaths(dir, rootDir='./'):
+    return join(rootDir, dir, 'track.sat.npy'), join(rootDir, dir, 'track.satTime.npy')
+
+
+def buildSat(t, hist):
+    # t sorted. S[i, j] is the sum of records < i and channels < j. int32 is
+    # used while the grand total fits, which halves the file size.
+    n, nCh = hist.shape
+    total = int(hist.sum())
+    dtype = np.int32 if total < 2 ** 31 else np.int64
+    S = np.zeros((n + 1, nCh + 1), dtype=dtype)
+    np.cumsum(hist, axis=1, dtype=dtype, out=S[1:, 1:])
+    np.cumsum(S[1:, 1:], axis=0, dtype=dtype, out=S[1:, 1:])
+    return S
+
+
+def loadTrackSat(dir, rootDir='./', rebuild=False, workers=4):
+    # Returns (S, times) where times[0] is the record epoch and times[1]
+    # the cumulative live time (n + 1 entries, leading 0). The cache is
+    # rebuilt when a log of the directory, or the directory itself (a log
+    # added or removed), is newer than it.
+    satPath, timePath = satPaths(dir, rootDir)
+    logs = list(logFilesOf([dir], rootDir))
+    newest = max([os.path.getmtime(join(rootDir, dir))] + [os.path.getmtime(f) for f in logs])
+    fresh = (os.path.exists(satPath) and os.path.exists(timePath)
+             and min(os.path.getmtime(satPath), os.path.getmtime(timePath)) >= newest)
+    if not rebuild and fresh:
+        return np.load(satPath, mmap_mode='r'), np.load(timePath)
+    recs, t, files, nDup = readMergedRecords([dir], rootDir, workers=workers)
+    S = buildSat(t, recs['hist'])
+    times = np.zeros((2, len(t) + 1), np.int64)
+    times[0, :len(t)] = t
+    times[0, len(t):] = t[-1] + 1 if len(t) else 0
+    times[1, 1:] = np.cumsum(np.maximum(recs['time'], 1))
+    try:
+        np.save(satPath, S)
+        np.save(timePath, times)
+    except OSError:
+        # read-only card, built again next time
+        return S, times
+    return np.load(satPath, mmap_mode='r'), times
+
+
+def rowRange(times, tStart, tEnd):
+    # Records with tStart <= t < tEnd
+    t = times[0, :-1]
+    return int(np.searchsorted(t, tStart, 'left')), int(np.searchsorted(t, tEnd, 'left'))
+
+
+def rectSum(S, r0, r1, c0, c1):
+    return int(S[r1, c1]) - int(S[r0, c1]) - int(S[r1, c0]) + int(S[r0, c0])
+
+
+def windowCounts(S, times, tStart, tEnd, loKeV, hiKeV, ecal=defaultEcal):
+    # Counts and live seconds in [tStart, tEnd) and [loKeV, hiKeV)
+    r0, r1 = rowRange(times, tStart, tEnd)
+    nCh = S.shape[1] - 1
+    c0, c1 = keVToChannels(loKeV, hiKeV, ecal, nCh)
+    return rectSum(S, r0, r1, c0, c1), int(times[1, r1] - times[1, r0])
+
+
+def coveredRange(times):
+    # First and last record epoch of the table, None for an empty track
+    if times.shape[1] < 2:
+        return None
+    return int(times[0, 0]), int(times[0, -2])
+
+
+def timeOfDay(times, hhmm):
+    # 'HH:MM' or 'HH:MM:SS' on the (UTC) day the track starts
+    day = np.datetime64(int(times[0, 0]), 's').astype('datetime64[D]')
+    parts = [int(p) for p in hhmm.split(':')] + [0]
+    return int((day - np.datetime64(0, 'D')).astype(np.int64)) * 86400 + parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+if __name__ == '__main__':
+    dir = sys.argv[1] if len(sys.argv) > 1 else 'G0000000'
+    S, times = loadTrackSat(dir)
+    first, last = coveredRange(times)
+    print(str(times.shape[1] - 1) + ' records, ' + str(np.datetime64(first, 's')) + ' .. '
+          + str(np.datetime64(last, 's')) + ' UTC')
+    tStart, tEnd = timeOfDay(times, '22:02'), timeOfDay(times, '22:09')
+    counts, live = windowCounts(S, times, tStart, tEnd, 600.0, 720.0)
+    print('600-720 keV, 22:02 to 22:09: ' + str(counts) + ' counts in ' + str(live) + ' s')
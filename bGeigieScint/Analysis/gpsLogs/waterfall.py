@@ -0,0 +1,64 @@
+import sys
+import numpy as np
+
+from logArrays import readRecords, recordEpoch
+from pngWriter import writePng
+
+# Energy-time waterfall, one row per time bin and one column per channel
+# bin, log scaled and coloured in NumPy and written straight to PNG.
+
+# viridis-like anchors, interpolated to a 256 entry lookup table
+cmapAnchors = np.array([
+    [68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37],
+], dtype=np.float64)
+
+
+def colormapLut(anchors=cmapAnchors, n=256):
+    x = np.linspace(0, 1, len(anchors))
+    xi = np.linspace(0, 1, n)
+    return np.stack([np.interp(xi, x, anchors[:, c]) for c in range(3)], axis=1).astype(np.uint8)
+
+
+def waterfallMatrix(t, hist, live, height=1000, channelBin=1):
+    # Sums records into height time rows over [t.min(), t.max()] and groups
+    # channelBin channels per column. Returns the matrix and the live
+    # seconds per row, no rows when there are no records.
+    hist = np.asarray(hist)
+    t = np.asarray(t)
+    nCol = hist.shape[1] // channelBin
+    if len(t) == 0:
+        return np.zeros((0, nCol)), np.zeros(0)
+    span = max(int(t.max() - t.min()) + 1, 1)
+    height = min(height, span)
+    row = ((t - t.min()) * height // span).astype(np.int64)
+    m = np.zeros((height, nCol * channelBin))
+    np.add.at(m, row, hist[:, :nCol * channelBin])
+    m = m.reshape(height, nCol, channelBin).sum(axis=2)
+    return m, np.bincount(row, weights=live, minlength=height)
+
+
+def waterfallImage(m, rowLive=None, lut=None):
+    # log scaling of the counts (per live second if given), then LUT lookup
+    if lut is None:
+        lut = colormapLut()
+    v = m if rowLive is None else m / np.maximum(rowLive, 1)[:, None]
+    v = np.log1p(v)
+    vMax = v.max()
+    idx = (v / vMax * (len(lut) - 1)).astype(np.int64) if vMax > 0 else np.zeros(v.shape, np.int64)
+    return lut[idx]
+
+
+def writeWaterfall(png, recs, height=1000, channelBin=1, maxChannel=None):
+    t = recordEpoch(recs)
+    hist = recs['hist'] if maxChannel is None else recs['hist'][:, :maxChannel]
+    if len(t) == 0:
+        raise ValueError('no records to draw a waterfall from')
+    m, live = waterfallMatrix(t, hist, np.maximum(recs['time'], 1), height, channelBin)
+    # rows with no data stay the background colour, the oldest row is on top
+    writePng(png, waterfallImage(m, live))
+
+
+if __name__ == '__main__':
+    recs, files = readRecords(sys.argv[1:] if len(sys.argv) > 1 else ['G0000000'])
+    writeWaterfall('waterfall.png', recs, height=600, channelBin=2, maxChannel=1023)
+    print('waterfall.png written')